@@ -1,11 +1,28 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-import openpyxl
+import csv
 import os
-import math
+import queue
+import threading
+import time
+
+import formula_engine
+import mapping_profiles
+import status_log
+import transfer_engine
+import transfer_profiler
 
 
 class ExcelProcessorApp:
+    LOG_DETAIL_LEVELS = {"Summary": status_log.SUMMARY, "Per file": status_log.FILE, "Per cell": status_log.CELL}
+    PROGRESS_POLL_MS = 100
+    CONSOLIDATED_FILE_NAME = "consolidated.xlsx"
+    MAPPING_COLUMNS = [("number", "#", 40), ("from_sheet", "From Sheet", 80), ("from_row", "Row", 45),
+                       ("from_col", "Col", 45), ("from_range", "Range", 90), ("lookup", "Lookup", 120),
+                       ("to_sheet", "To Sheet", 80),
+                       ("to_row", "Row", 45), ("to_col", "Col", 45), ("convert", "Convert", 55),
+                       ("formula", "Formula", 110), ("problem", "Problem", 200)]
+
     def __init__(self, root_window):
         self.root = root_window
         self.root.title("Datasheet Transfer Tool")
@@ -15,7 +32,21 @@ class ExcelProcessorApp:
         self.source_files = []
         self.base_file = tk.StringVar()
         self.output_folder_name = tk.StringVar()
-        self.mapping_rows_data = []                     # Stores info for each mapping in a dictionary
+        self.mapping_rows = []                          # Raw mapping rows, one dictionary of MAPPING_FIELDS each
+        self.mapping_errors = {}                        # Row index -> problem found by the last check
+        self.editing_row = None                         # Index of the row shown in the mapping editor
+        self.loaded_profile = None                      # (mapping rows, plan) of the last loaded/saved profile
+        self.log_detail = tk.StringVar(value="Per file")
+        self.write_log_file = tk.BooleanVar(value=False)
+        self.force_rebuild = tk.BooleanVar(value=False)     # Ignore the output folder's manifest
+        self.consolidate = tk.BooleanVar(value=False)       # One row per source in a single output file
+        self.write_timing_report = tk.BooleanVar(value=False)
+        self.profile = None                             # TransferProfile of the running batch, if requested
+        self.repaint_baseline = (0.0, 0)
+        self.status_log = status_log.StatusLog(status_log.FILE)
+        self.progress_queue = queue.Queue()             # Worker thread -> Tk thread messages
+        self.cancel_event = None
+        self.transfer_started = None
 
         ''' UI Frames '''
         self.file_selection_frame = ttk.LabelFrame(self.root, text="1. File Selection", padding=10)
@@ -25,22 +56,30 @@ class ExcelProcessorApp:
         self.mapping_frame_container.pack(padx=10, pady=5, fill="both", expand=True)
 
         ''' Cell Mappings window '''
-        self.canvas = tk.Canvas(self.mapping_frame_container)
-        self.scrollbar = ttk.Scrollbar(self.mapping_frame_container, orient="vertical", command=self.canvas.yview)
-        self.scrollable_frame = ttk.Frame(self.canvas)
-
-        self.scrollable_frame.bind(
-            "<Configure>",
-            lambda e: self.canvas.configure(
-                scrollregion=self.canvas.bbox("all")
-            )
-        )
-
-        self.canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
-        self.canvas.configure(yscrollcommand=self.scrollbar.set)
-
-        self.canvas.pack(side="left", fill="both", expand=True)
-        self.scrollbar.pack(side="right", fill="y")
+        # The table only draws the rows in view, so thousands of mappings stay responsive;
+        # the selected row is edited in the single set of fields below it
+        self.mapping_toolbar = ttk.Frame(self.mapping_frame_container)
+        self.mapping_toolbar.pack(fill="x", pady=(0, 5))
+
+        self.mapping_table_frame = ttk.Frame(self.mapping_frame_container)
+        self.mapping_table_frame.pack(fill="both", expand=True)
+        self.mapping_table = ttk.Treeview(self.mapping_table_frame, columns=[c for c, _, _ in self.MAPPING_COLUMNS],
+                                          show="headings", selectmode="extended", height=8)
+        for column, heading, width in self.MAPPING_COLUMNS:
+            self.mapping_table.heading(column, text=heading)
+            self.mapping_table.column(column, width=width, stretch=column in ("formula", "problem"))
+        self.mapping_table.tag_configure("invalid", foreground="red")
+        self.mapping_scrollbar = ttk.Scrollbar(self.mapping_table_frame, orient="vertical",
+                                               command=self.mapping_table.yview)
+        self.mapping_table.configure(yscrollcommand=self.mapping_scrollbar.set)
+        self.mapping_table.pack(side="left", fill="both", expand=True)
+        self.mapping_scrollbar.pack(side="right", fill="y")
+        self.mapping_table.bind("<<TreeviewSelect>>", self.select_mapping_row)
+        self.mapping_table.bind("<Delete>", lambda event: self.delete_mapping_rows())
+
+        self.mapping_editor = ttk.Frame(self.mapping_frame_container, padding=(0, 5, 0, 0))
+        self.mapping_editor.pack(fill="x")
+        self.build_mapping_editor()
 
         self.action_frame = ttk.LabelFrame(self.root, text="3. Actions", padding=10)
         self.action_frame.pack(padx=10, pady=10, fill="x")
@@ -76,24 +115,69 @@ class ExcelProcessorApp:
         self.status_text.config(yscrollcommand=self.status_text_scrollbar.set)
         self.status_text.pack(side="left", fill="both", expand=True)
         self.status_text_scrollbar.pack(side="right", fill="y")
+        self.log_view = status_log.TextLogView(self.root, self.status_text, self.status_log)
 
         ''' Initialize Mapping UI '''
         self.add_mapping_row()  # First mapping row
 
+        ''' Progress '''
+        self.progress_frame = ttk.Frame(self.action_frame)
+        self.progress_frame.pack(side="bottom", fill="x", pady=(5, 0))
+        self.progress_bar = ttk.Progressbar(self.progress_frame, orient="horizontal", mode="determinate")
+        self.progress_bar.pack(side="left", fill="x", expand=True, padx=5)
+        self.progress_label = ttk.Label(self.progress_frame, text="Idle", width=40)
+        self.progress_label.pack(side="right", padx=5)
+
         ''' Mapping Buttons '''
-        self.add_row_button = ttk.Button(self.action_frame, text="Add Mapping Row", command=self.add_mapping_row)
-        self.add_row_button.pack(side="left", padx=5, pady=5)
+        self.add_row_button = ttk.Button(self.mapping_toolbar, text="Add Mapping Row", command=self.add_mapping_row)
+        self.add_row_button.pack(side="left", padx=5)
+
+        self.delete_rows_button = ttk.Button(self.mapping_toolbar, text="Delete Row(s)",
+                                             command=self.delete_mapping_rows)
+        self.delete_rows_button.pack(side="left", padx=5)
+
+        self.import_button = ttk.Button(self.mapping_toolbar, text="Import CSV...", command=self.import_mappings)
+        self.import_button.pack(side="left", padx=5)
+
+        self.export_button = ttk.Button(self.mapping_toolbar, text="Export CSV...", command=self.export_mappings)
+        self.export_button.pack(side="left", padx=5)
+
+        self.load_profile_button = ttk.Button(self.mapping_toolbar, text="Load Profile...", command=self.load_profile)
+        self.load_profile_button.pack(side="left", padx=5)
+
+        self.save_profile_button = ttk.Button(self.mapping_toolbar, text="Save Profile...", command=self.save_profile)
+        self.save_profile_button.pack(side="left", padx=5)
 
         self.transfer_button = ttk.Button(self.action_frame, text="Transfer Values", command=self.transfer_values)
         self.transfer_button.pack(side="left", padx=5, pady=5)
 
+        self.cancel_button = ttk.Button(self.action_frame, text="Cancel", command=self.cancel_transfer,
+                                        state=tk.DISABLED)
+        self.cancel_button.pack(side="left", padx=5, pady=5)
+
+        ''' Run Options '''
+        self.force_check = ttk.Checkbutton(self.action_frame, text="Rebuild all", variable=self.force_rebuild)
+        self.force_check.pack(side="right", padx=5, pady=5)
+        self.consolidate_check = ttk.Checkbutton(self.action_frame, text="Consolidate into one file",
+                                                 variable=self.consolidate)
+        self.consolidate_check.pack(side="right", padx=5, pady=5)
+
+        ''' Log Options '''
+        self.write_log_check = ttk.Checkbutton(self.action_frame, text="Write full log file",
+                                               variable=self.write_log_file)
+        self.write_log_check.pack(side="right", padx=5, pady=5)
+        self.timing_report_check = ttk.Checkbutton(self.action_frame, text="Timing report",
+                                                   variable=self.write_timing_report)
+        self.timing_report_check.pack(side="right", padx=5, pady=5)
+        self.log_detail_combo = ttk.Combobox(self.action_frame, textvariable=self.log_detail, width=10,
+                                             values=list(self.LOG_DETAIL_LEVELS), state="readonly")
+        self.log_detail_combo.pack(side="right", padx=5, pady=5)
+        ttk.Label(self.action_frame, text="Log detail:").pack(side="right", padx=2, pady=5)
+
     ''' Status Log window '''
-    def log_status(self, message):
-        self.status_text.config(state=tk.NORMAL)
-        self.status_text.insert(tk.END, message + "\n")
-        self.status_text.see(tk.END)  # Scroll to the end
-        self.status_text.config(state=tk.DISABLED)
-        self.root.update_idletasks()  # Ensure GUI updates
+    def log_status(self, message, level=status_log.SUMMARY):
+        # Buffered; the log view repaints the widget on a timer
+        self.status_log(message, level)
 
     ''' Source File(s) selection text '''
     def select_source_files(self):
@@ -124,313 +208,430 @@ class ExcelProcessorApp:
             self.base_file_label.config(text="No base file selected.")
             self.log_status("Base file selection cancelled.")
 
-    ''' Adding Mapping Rows '''
-    def add_mapping_row(self):
-        row_frame = ttk.Frame(self.scrollable_frame, padding=5)
-        row_frame.pack(fill="x", pady=2)
-
-        row_number = len(self.mapping_rows_data) + 1
-        ttk.Label(row_frame, text=f"Mapping {row_number}:").grid(row=0, column=0, columnspan=6, sticky="w", pady=(0, 5))
+    ''' Mapping editor '''
+    def build_mapping_editor(self):
+        # One set of entry widgets for the selected row; every edit goes straight into self.mapping_rows
+        editor = self.mapping_editor
+        self.editor_vars = {field: tk.StringVar() for field in
+                            ("from_row", "from_col", "from_range", "from_sheet", "lookup_col", "lookup_key",
+                             "to_row", "to_col", "to_sheet", "formula")}
+        self.editor_vars["convert"] = tk.BooleanVar()
+        self.editor_entries = []
+
+        def entry(field, width, row, column, **grid):
+            widget = ttk.Entry(editor, textvariable=self.editor_vars[field], width=width)
+            widget.grid(row=row, column=column, padx=2, **grid)
+            self.editor_entries.append(widget)
+            return widget
+
+        self.editor_label = ttk.Label(editor, text="No mapping selected.")
+        self.editor_label.grid(row=0, column=0, columnspan=9, sticky="w", pady=(0, 5))
 
         # "From" row
-        ttk.Label(row_frame, text="From:").grid(row=1, column=0, padx=2, sticky="w")
-        ttk.Label(row_frame, text="Row:").grid(row=1, column=1, padx=2)
-        from_row_var = tk.StringVar()
-        from_row_entry = ttk.Entry(row_frame, textvariable=from_row_var, width=5)
-        from_row_entry.grid(row=1, column=2, padx=2)
-
-        ttk.Label(row_frame, text="Col:").grid(row=1, column=3, padx=2)
-        from_col_var = tk.StringVar()
-        from_col_entry = ttk.Entry(row_frame, textvariable=from_col_var, width=5)
-        from_col_entry.grid(row=1, column=4, padx=2)
+        ttk.Label(editor, text="From:").grid(row=1, column=0, padx=2, sticky="w")
+        ttk.Label(editor, text="Row:").grid(row=1, column=1, padx=2)
+        entry("from_row", 5, 1, 2)
+        ttk.Label(editor, text="Col:").grid(row=1, column=3, padx=2)
+        entry("from_col", 5, 1, 4)
+        # Or a whole block of cells, e.g. B10:AZ210; "To" is then its top-left cell
+        ttk.Label(editor, text="or Range:").grid(row=1, column=5, padx=2, sticky="e")
+        entry("from_range", 12, 1, 6, sticky="w")
+        # Sheet names; empty means the active sheet
+        ttk.Label(editor, text="Sheet:").grid(row=1, column=7, padx=2, sticky="e")
+        entry("from_sheet", 12, 1, 8, sticky="w")
+
+        # Or look the row up by key: the value in Col where the Key Col cell equals the key, e.g. "Rated Voltage"
+        ttk.Label(editor, text="or Lookup:").grid(row=2, column=0, padx=2, sticky="w")
+        ttk.Label(editor, text="Key Col:").grid(row=2, column=1, padx=2)
+        entry("lookup_col", 5, 2, 2)
+        ttk.Label(editor, text="equals:").grid(row=2, column=3, padx=2)
+        entry("lookup_key", 20, 2, 4, columnspan=3, sticky="ew")
 
         # "To" row
-        ttk.Label(row_frame, text="To:").grid(row=2, column=0, padx=2, sticky="w")
-        ttk.Label(row_frame, text="Row:").grid(row=2, column=1, padx=2)
-        to_row_var = tk.StringVar()
-        to_row_entry = ttk.Entry(row_frame, textvariable=to_row_var, width=5)
-        to_row_entry.grid(row=2, column=2, padx=2)
-
-        ttk.Label(row_frame, text="Col:").grid(row=2, column=3, padx=2)
-        to_col_var = tk.StringVar()
-        to_col_entry = ttk.Entry(row_frame, textvariable=to_col_var, width=5)
-        to_col_entry.grid(row=2, column=4, padx=2)
+        ttk.Label(editor, text="To:").grid(row=3, column=0, padx=2, sticky="w")
+        ttk.Label(editor, text="Row:").grid(row=3, column=1, padx=2)
+        entry("to_row", 5, 3, 2)
+        ttk.Label(editor, text="Col:").grid(row=3, column=3, padx=2)
+        entry("to_col", 5, 3, 4)
+        ttk.Label(editor, text="Sheet:").grid(row=3, column=7, padx=2, sticky="e")
+        entry("to_sheet", 12, 3, 8, sticky="w")
 
         # Conversion Option
-        convert_var = tk.BooleanVar()
-        formula_var = tk.StringVar()
-        formula_entry = ttk.Entry(row_frame, textvariable=formula_var, width=20, state=tk.DISABLED)
-
-        def toggle_formula_entry():
-            if convert_var.get():
-                formula_entry.config(state=tk.NORMAL)
-                test_button.config(state=tk.NORMAL)
-            else:
-                formula_entry.config(state=tk.DISABLED)
-                test_button.config(state=tk.DISABLED)
-                demo_label.config(text="")
-
-        convert_check = ttk.Checkbutton(row_frame, text="Convert", variable=convert_var, command=toggle_formula_entry)
-        convert_check.grid(row=3, column=0, columnspan=2, padx=2, sticky="w")
-
-        ttk.Label(row_frame, text="Formula (use 'X'):").grid(row=3, column=2, columnspan=2, padx=2, sticky="e")
-        formula_entry.grid(row=3, column=4, columnspan=2, padx=2, sticky="ew")
+        self.convert_check = ttk.Checkbutton(editor, text="Convert", variable=self.editor_vars["convert"],
+                                             command=self.update_formula_state)
+        self.convert_check.grid(row=4, column=0, columnspan=2, padx=2, sticky="w")
+        ttk.Label(editor, text="Formula (use 'X'):").grid(row=4, column=2, columnspan=2, padx=2, sticky="e")
+        self.formula_entry = ttk.Entry(editor, textvariable=self.editor_vars["formula"], width=20)
+        self.formula_entry.grid(row=4, column=4, columnspan=3, padx=2, sticky="ew")
 
         # Test conversion formula
-        demo_text_var = tk.StringVar(value="X=1 -> ?")
-        demo_label = ttk.Label(row_frame, textvariable=demo_text_var, width=20)
-        demo_label.grid(row=4, column=2, columnspan=2, padx=2, pady=(2, 0), sticky="w")
-
-        # Create convert test button
-        test_button = ttk.Button(
-            row_frame,
+        self.demo_label = ttk.Label(editor, text="", width=20)
+        self.demo_label.grid(row=5, column=2, columnspan=2, padx=2, pady=(2, 0), sticky="w")
+        self.test_button = ttk.Button(
+            editor,
             text="Test Formula",
-            command=lambda fv=formula_var, dl=demo_label: (self.test_formula_conversion(fv, dl))
+            command=lambda: self.test_formula_conversion(self.editor_vars["formula"], self.demo_label)
         )
-        test_button.grid(row=4, column=0, columnspan=2, padx=2, pady=(2, 0), sticky="w")
+        self.test_button.grid(row=5, column=0, columnspan=2, padx=2, pady=(2, 0), sticky="w")
+
+        editor.columnconfigure(6, weight=1)  # Make formula entry expandable
+        for field, var in self.editor_vars.items():
+            var.trace_add("write", lambda *args, field=field: self.edit_mapping_field(field))
+        self.show_mapping_row(None)
+
+    def update_formula_state(self):
+        enabled = self.editing_row is not None and self.editor_vars["convert"].get()
+        self.formula_entry.config(state=tk.NORMAL if enabled else tk.DISABLED)
+        self.test_button.config(state=tk.NORMAL if enabled else tk.DISABLED)
+        if not enabled:
+            self.demo_label.config(text="")  # Clear demo text if convert is off
+
+    def show_mapping_row(self, index):
+        # Load a row into the editor (None clears and disables it)
+        self.editing_row = None  # No write-backs while the fields are filled in
+        row = self.mapping_rows[index] if index is not None else self.new_mapping_row()
+        for field, var in self.editor_vars.items():
+            var.set(row[field])
+        self.editing_row = index
+        state = tk.NORMAL if index is not None else tk.DISABLED
+        for widget in self.editor_entries:
+            widget.config(state=state)
+        self.convert_check.config(state=state)
+        self.update_formula_state()
+        if index is None:
+            self.editor_label.config(text="No mapping selected.")
+        else:
+            self.editor_label.config(text=f"Mapping {index + 1}:")
+
+    def select_mapping_row(self, event=None):
+        selection = self.mapping_table.selection()
+        focus = self.mapping_table.focus()
+        index = int(focus) if focus in selection else int(selection[0]) if selection else None
+        if index != self.editing_row:
+            self.show_mapping_row(index)
+
+    def edit_mapping_field(self, field):
+        if self.editing_row is None:
+            return
+        self.mapping_rows[self.editing_row][field] = self.editor_vars[field].get()
+        # The row is checked again with the others before the next transfer
+        self.mapping_errors.pop(self.editing_row, None)
+        self.refresh_mapping_item(self.editing_row)
+
+    ''' Mapping table '''
+    @staticmethod
+    def new_mapping_row(values=None):
+        row = {field: "" for field in transfer_engine.MAPPING_FIELDS}
+        row["convert"] = False
+        if values:
+            row.update((field, values[field]) for field in row if values.get(field) is not None)
+        return row
+
+    def mapping_table_values(self, index):
+        row = self.mapping_rows[index]
+        values = [index + 1]
+        for column, _, _ in self.MAPPING_COLUMNS[1:]:
+            if column == "convert":
+                values.append("Yes" if row["convert"] else "")
+            elif column == "problem":
+                values.append(self.mapping_errors.get(index, ""))
+            elif column == "lookup":
+                values.append(f"{row['lookup_col']} = {row['lookup_key']}" if row["lookup_col"] or row["lookup_key"] else "")
+            else:
+                values.append(row[column])
+        return values
+
+    def refresh_mapping_item(self, index):
+        self.mapping_table.item(str(index), values=self.mapping_table_values(index),
+                                tags=("invalid",) if index in self.mapping_errors else ())
+
+    def set_mapping_rows(self, rows):
+        # Replace every row at once (profile load, CSV import, deletes)
+        self.mapping_rows = [self.new_mapping_row(row) for row in rows]
+        self.mapping_errors = {}
+        self.mapping_table.delete(*self.mapping_table.get_children())
+        for index in range(len(self.mapping_rows)):
+            self.mapping_table.insert("", "end", iid=str(index), values=self.mapping_table_values(index))
+        self.show_mapping_row(None)
+        if self.mapping_rows:
+            self.mapping_table.selection_set("0")
+            self.mapping_table.focus("0")
+
+    def add_mapping_row(self):
+        self.mapping_rows.append(self.new_mapping_row())
+        index = len(self.mapping_rows) - 1
+        self.mapping_table.insert("", "end", iid=str(index), values=self.mapping_table_values(index))
+        self.mapping_table.selection_set(str(index))
+        self.mapping_table.focus(str(index))
+        self.mapping_table.see(str(index))
+        self.log_status(f"Added mapping row {index + 1}.")
+
+    def delete_mapping_rows(self):
+        selected = {int(iid) for iid in self.mapping_table.selection()}
+        if not selected:
+            return
+        self.set_mapping_rows([row for index, row in enumerate(self.mapping_rows) if index not in selected])
+        self.log_status(f"Deleted {len(selected)} mapping row(s).")
+
+    def check_mapping_rows(self, require_target):
+        # Validate every row in one pass and mark the bad ones; returns the (row index, message) list
+        errors = transfer_engine.mapping_row_errors(self.mapping_rows, require_target)
+        flagged = set(self.mapping_errors)
+        self.mapping_errors = {index: message.splitlines()[0] for index, message in errors}
+        for index in flagged | set(self.mapping_errors):
+            self.refresh_mapping_item(index)
+        if errors:
+            self.mapping_table.see(str(errors[0][0]))
+            self.log_status(f"{len(errors)} mapping row(s) need fixing (marked in red in the Problem column).")
+        return errors
+
+    ''' Mapping CSV import / export '''
+    def import_mappings(self):
+        path = filedialog.askopenfilename(title="Import Mappings",
+                                          filetypes=(("Mapping CSV files", "*.csv"), ("All files", "*.*")))
+        if not path:
+            return
+        try:
+            rows = transfer_engine.load_mapping_rows(path)
+        except (OSError, ValueError, csv.Error) as e:
+            messagebox.showerror("Import Error", f"Could not read mappings: {e}")
+            self.log_status(f"Error: could not read mappings: {e}")
+            return
+        self.set_mapping_rows(rows)
+        self.loaded_profile = None
+        self.log_status(f"Imported {len(rows)} mapping row(s) from {os.path.basename(path)}.")
+        self.check_mapping_rows(require_target=not self.consolidate.get())
+
+    def export_mappings(self):
+        path = filedialog.asksaveasfilename(title="Export Mappings", defaultextension=".csv",
+                                            filetypes=(("Mapping CSV files", "*.csv"), ("All files", "*.*")))
+        if not path:
+            return
+        try:
+            transfer_engine.save_mapping_rows(path, self.mapping_rows)
+        except OSError as e:
+            messagebox.showerror("Export Error", f"Could not save mappings: {e}")
+            self.log_status(f"Error: could not save mappings: {e}")
+            return
+        self.log_status(f"Exported {len(self.mapping_rows)} mapping row(s) to {os.path.basename(path)}.")
 
-        # Test button initially disabled
-        if not convert_var.get():
-            test_button.config(state=tk.DISABLED)
-            demo_label.config(text="")  # Clear demo text if convert is off
+    ''' Mapping Profiles '''
+    def current_mapping_rows(self):
+        return [dict(row) for row in self.mapping_rows]
 
-        row_frame.columnconfigure(5, weight=1)  # Make formula entry expandable
+    def load_profile(self):
+        path = filedialog.askopenfilename(title="Load Mapping Profile",
+                                          filetypes=(("Mapping profiles", "*.json"), ("All files", "*.*")))
+        if not path:
+            return
+        try:
+            mappings = mapping_profiles.load_profile(path)
+        except (transfer_engine.MappingError, OSError) as e:
+            messagebox.showerror("Profile Error", str(e))
+            self.log_status(f"Error: {e}")
+            return
 
-        # Store variables in dictionary
-        self.mapping_rows_data.append({
-            "from_row": from_row_var, "from_col": from_col_var,
-            "to_row": to_row_var, "to_col": to_col_var,
-            "convert": convert_var, "formula": formula_var
-        })
+        self.set_mapping_rows(mapping_profiles.plan_to_rows(mappings))
+        self.loaded_profile = (self.current_mapping_rows(), mappings)
+        self.log_status(f"Loaded mapping profile {os.path.basename(path)} ({len(mappings)} mappings).")
 
-        self.log_status(f"Added mapping row {row_number}.")
-        self.scrollable_frame.update_idletasks()
-        self.canvas.config(scrollregion=self.canvas.bbox("all"))
+    def save_profile(self):
+        try:
+            mappings = transfer_engine.build_mapping_plan(self.current_mapping_rows(),
+                                                          require_target=not self.consolidate.get())
+        except transfer_engine.MappingError as e:
+            self.check_mapping_rows(require_target=not self.consolidate.get())
+            messagebox.showerror("Input Error", str(e))
+            self.log_status(f"Error: {e}")
+            return
+        path = filedialog.asksaveasfilename(title="Save Mapping Profile", defaultextension=".json",
+                                            filetypes=(("Mapping profiles", "*.json"), ("All files", "*.*")))
+        if not path:
+            return
+        try:
+            mapping_profiles.save_profile(path, mappings)
+        except OSError as e:
+            messagebox.showerror("Profile Error", f"Could not save profile: {e}")
+            self.log_status(f"Error: could not save profile: {e}")
+            return
+        self.loaded_profile = (self.current_mapping_rows(), mappings)
+        self.log_status(f"Saved mapping profile {os.path.basename(path)} ({len(mappings)} mappings).")
+
+    def mapping_plan(self, consolidate):
+        # Reuse the plan of the loaded profile while its rows are unchanged; otherwise validate the rows
+        mapping_rows = self.current_mapping_rows()
+        if self.loaded_profile is not None and self.loaded_profile[0] == mapping_rows:
+            mappings = self.loaded_profile[1]
+            if consolidate or all(mapping["to_row"] is not None for mapping in mappings):
+                return mappings
+        return transfer_engine.build_mapping_plan(mapping_rows, require_target=not consolidate)
 
     def test_formula_conversion(self, formula_var, demo_label_widget):
         formula_str = formula_var.get()
-        original_formula_for_test_log = formula_str
-        formula_str = formula_str.replace('x', 'X')  # Convert 'x' to 'X' for both cases
-        if not formula_str:
+        if not formula_str.strip():
             demo_label_widget.config(text="X=1 -> (enter formula)")
             return
         try:
-            eval_globals = {"__builtins__": {}, "math": math}
-            eval_locals = {"X": 1}  # Test with X=1
-
-            result = eval(formula_str, eval_globals, eval_locals)
-            print(result)
+            formula = formula_engine.compile_formula(formula_str)
+            result = formula(1)  # Test with X=1
             # Format result nicely, especially floats
             if isinstance(result, float):
                 demo_text = f"X=1 -> {result:.4f}"
             else:
                 demo_text = f"X=1 -> {result}"
             demo_label_widget.config(text=demo_text, foreground="green")
-            self.log_status(f"Formula Test (X=1): User entered '{original_formula_for_test_log}', Evaluated as '{formula_str}' -> Result: {result}")
+            self.log_status(f"Formula Test (X=1): User entered '{formula_str}', Evaluated as '{formula.expression}' -> Result: {result}")
         except Exception as e:
             demo_label_widget.config(text="Invalid equation", foreground="red")
-            self.log_status(f"Formula Test (X=1): User entered '{original_formula_for_test_log}', Evaluated as '{formula_str}' -> Invalid equation. Error: {e}")
+            self.log_status(f"Formula Test (X=1): User entered '{formula_str}' -> Invalid equation. Error: {e}")
 
     # Move values over
     def transfer_values(self):
         if not self.source_files:
             messagebox.showerror("Error", "Please select at least one source Excel file.")
             return
-        if not self.base_file.get():
+        consolidate = self.consolidate.get()
+        if not self.base_file.get() and not consolidate:
             messagebox.showerror("Error", "Please select a base Excel file.")
             return
-        if not self.mapping_rows_data:  # Check for dictionary or dictionaries
-            # Need all From and To info
-            if not any(self.mapping_rows_data[0][key].get() for key in ["from_row", "from_col", "to_row", "to_col"]):
-                messagebox.showerror("Error", "Please add and fill at least one mapping row.")
-                return
-
-        output_folder_str = self.output_folder_name.get().strip()
-        if not output_folder_str:
-            messagebox.showerror("Error", "Please specify an output folder name.")
-            self.log_status("Error: Output folder name not specified.")
+
+        # Create output folder in same directory as base file (or the first source file when consolidating)
+        try:
+            output_folder_path = transfer_engine.resolve_output_folder(self.base_file.get() or self.source_files[0],
+                                                                       self.output_folder_name.get())
+        except transfer_engine.TransferError as e:
+            messagebox.showerror("Error", str(e))
+            self.log_status(f"Error: {e}")
             return
 
-        # Create output folder in same directory as base file
-        base_file_full_path = self.base_file.get()
-        if not base_file_full_path or not os.path.isfile(base_file_full_path):
-            messagebox.showerror("Error",
-                                 "Base file path is invalid or not selected. Cannot determine output folder location.")
-            self.log_status("Error: Base file path invalid for output folder creation.")
+        # Get From - To info out of dictionary
+        try:
+            mappings = self.mapping_plan(consolidate)
+        except transfer_engine.MappingError as e:
+            self.check_mapping_rows(require_target=not consolidate)
+            messagebox.showerror("Input Error", str(e))
+            self.log_status(f"Error: {e}")
             return
 
-        # Put folder in same folder as Base File
-        base_file_dir = os.path.dirname(base_file_full_path)
-        output_folder_path = os.path.join(base_file_dir, output_folder_str)
-        output_folder_path = os.path.abspath(output_folder_path)
+        self.status_log.verbosity = self.LOG_DETAIL_LEVELS[self.log_detail.get()]
+        log_file = os.path.join(output_folder_path, "transfer_log.txt") if self.write_log_file.get() else None
+
+        # Run the batch off the Tk thread; progress comes back through progress_queue
+        self.cancel_event = threading.Event()
+        self.set_running(True)
+        self.progress_bar.config(maximum=len(self.source_files), value=0)
+        self.progress_label.config(text=f"0 / {len(self.source_files)} files")
+        self.transfer_started = time.monotonic()
+        self.profile = transfer_profiler.TransferProfile() if self.write_timing_report.get() else None
+        self.repaint_baseline = (self.log_view.flush_seconds, self.log_view.flushes)
+        worker = threading.Thread(
+            target=self.transfer_worker,
+            args=(mappings, list(self.source_files), self.base_file.get(), output_folder_path, log_file,
+                  self.force_rebuild.get(), consolidate),
+            name="transfer-worker", daemon=True)
+        worker.start()
+        self.root.after(self.PROGRESS_POLL_MS, self.poll_progress)
+
+    ''' Background transfer '''
+    def transfer_worker(self, mappings, source_files, base_file_path, output_folder_path, log_file, force,
+                        consolidate):
+        # Runs on the worker thread: only touches the thread-safe status log and progress queue
+        def progress(done, total, result):
+            self.progress_queue.put(("progress", done, total))
 
         try:
-            if not os.path.exists(output_folder_path):
-                os.makedirs(output_folder_path)
-                self.log_status(f"Created output folder: {output_folder_path}")
+            if log_file:
+                os.makedirs(output_folder_path, exist_ok=True)
+                self.status_log.open_file(log_file)
+            if consolidate:
+                report = transfer_engine.run_consolidation(
+                    mappings, source_files, os.path.join(output_folder_path, self.CONSOLIDATED_FILE_NAME),
+                    log=self.status_log, progress=progress, cancel=self.cancel_event, profile=self.profile)
             else:
-                if not os.path.isdir(output_folder_path):
-                    messagebox.showerror("Error", f"Output path '{output_folder_path}' exists but is not a folder.")
-                    self.log_status(f"Error: Output path '{output_folder_path}' is not a folder.")
-                    return
-                self.log_status(f"Using existing output folder: {output_folder_path}")
+                report = transfer_engine.run_transfer(mappings, source_files, base_file_path, output_folder_path,
+                                                      log=self.status_log, progress=progress,
+                                                      cancel=self.cancel_event, force=force, profile=self.profile)
+            self.progress_queue.put(("done", report))
         except Exception as e:
-            messagebox.showerror("Error", f"Could not create or access output folder '{output_folder_path}': {e}")
-            self.log_status(f"Error creating/accessing output folder '{output_folder_path}': {e}")
-            return
-
-        self.log_status("Starting value transfer process...")
-        processed_files_count = 0
+            self.progress_queue.put(("error", e))
+        finally:
+            self.status_log.close_file()
 
-        # Get From - To info out of dictionary
-        mappings = []
-        for i, row_data in enumerate(self.mapping_rows_data):
+    def poll_progress(self):
+        finished = None
+        while True:
             try:
-                # Check for From and To
-                if not (row_data["from_row"].get() or row_data["from_col"].get() or \
-                        row_data["to_row"].get() or row_data["to_col"].get()):
-                    if len(self.mapping_rows_data) == 1:  # If it's the only row and it's empty
-                        messagebox.showerror("Input Error",
-                                             "The mapping row is empty. Please fill in the row and column numbers.")
-                        self.log_status("Error: Mapping row is empty.")
-                        return
-                    continue  # Skip this empty row if there are other rows
-
-                from_r_str = row_data["from_row"].get()
-                from_c_str = letter_convert[row_data["from_col"].get().lower()]
-                to_r_str = row_data["to_row"].get()
-                to_c_str = letter_convert[row_data["to_col"].get().lower()]
-
-                if not (from_r_str and from_c_str and to_r_str and to_c_str):
-                    messagebox.showerror("Input Error", f"Missing Row/Column in mapping row {i + 1}.")
-                    self.log_status(f"Error in mapping row {i + 1}: Missing Row/Column.")
-                    return
-
-                from_r = int(from_r_str)
-                from_c = int(from_c_str)
-                to_r = int(to_r_str)
-                to_c = int(to_c_str)
-
-                if not (from_r > 0 and from_c > 0 and to_r > 0 and to_c > 0):
-                    raise ValueError("Invalid Row/Column specified.")
-
-                mappings.append({
-                    "from_row": from_r, "from_col": from_c,
-                    "to_row": to_r, "to_col": to_c,
-                    "convert": row_data["convert"].get(),
-                    "formula": row_data["formula"].get()
-                })
-            except ValueError as e:
-                messagebox.showerror("Input Error",
-                                     f"Invalid input in mapping row {i + 1}: {e}\nPlease enter valid positive integers for rows and columns.")
-                self.log_status(f"Error in mapping row {i + 1}: {e}")
-                return
-
-        if not mappings:  # If after validation, no valid mappings were collected
-            messagebox.showerror("Error",
-                                 "No valid mappings provided. Please fill in at least one mapping row correctly.")
-            self.log_status("Error: No valid mappings collected.")
+                item = self.progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[0] == "progress":
+                self.update_progress(item[1], item[2])
+            else:
+                finished = item
+
+        if finished is None:
+            self.root.after(self.PROGRESS_POLL_MS, self.poll_progress)
             return
 
-        self.log_status(f"Collected {len(mappings)} mapping configurations.")
+        self.set_running(False)
+        self.log_view.flush()
+        if finished[0] == "error":
+            messagebox.showerror("Error", str(finished[1]))
+            self.log_status(f"Error: {finished[1]}")
+            return
 
-        # Iterate Source Files
-        for source_file_path in self.source_files:
-            try:
-                self.log_status(f"\nProcessing source file: {os.path.basename(source_file_path)}")
-
-                # Load source workbook
-                source_wb = openpyxl.load_workbook(source_file_path, data_only=True)
-                source_sheet = source_wb.active
-
-                # Load a fresh copy of the base workbook for each source file
-                base_wb_path = self.base_file.get()
-                base_wb_copy = openpyxl.load_workbook(base_wb_path)
-                base_sheet_copy = base_wb_copy.active
-
-                # Apply mappings
-                for i, mapping in enumerate(mappings):
-                    self.log_status(
-                        f"  Applying mapping {i + 1}: From ({mapping['from_row']},{mapping['from_col']}) To ({mapping['to_row']},{mapping['to_col']})")
-
-                    try:
-                        source_value = source_sheet.cell(row=mapping["from_row"], column=mapping["from_col"]).value
-                        self.log_status(
-                            f"    Read value '{source_value}' from source cell ({mapping['from_row']},{mapping['from_col']}).")
-                    except Exception as e:
-                        self.log_status(
-                            f"    ERROR reading from source cell ({mapping['from_row']},{mapping['from_col']}): {e}")
-                        continue
-
-                    value_to_paste = source_value
-
-                    if mapping["convert"] and mapping["formula"]:
-                        formula_str = mapping["formula"]
-                        original_formula_for_log = formula_str  # Keep original for logging
-                        formula_str = formula_str.replace('x', 'X')  # Convert 'x' to 'X' for both cases
-                        try:
-                            eval_globals = {"__builtins__": {}, "math": math}
-                            eval_locals = {"X": source_value}
-                            converted_value = eval(formula_str, eval_globals, eval_locals)
-                            value_to_paste = converted_value
-                            self.log_status(f"    Applied formula (User: '{original_formula_for_log}', Evaluated: '{formula_str}'). Original: {source_value}, Converted: {converted_value}")
-                        except Exception as e:
-                            self.log_status(f"    ERROR applying formula (User: '{original_formula_for_log}', Evaluated: '{formula_str}') to value '{source_value}': {e}. Using original value.")
-
-                    try:
-                        base_sheet_copy.cell(row=mapping["to_row"], column=mapping["to_col"]).value = value_to_paste
-                        self.log_status(
-                            f"    Wrote value '{value_to_paste}' to target cell ({mapping['to_row']},{mapping['to_col']}).")
-                    except Exception as e:
-                        self.log_status(
-                            f"    ERROR writing to target cell ({mapping['to_row']},{mapping['to_col']}): {e}")
-
-                # Define output path within the specified output folder
-                output_filename = os.path.join(output_folder_path, os.path.basename(source_file_path))
-
-                try:
-                    base_wb_copy.save(output_filename)
-                    self.log_status(f"  Successfully processed. Output saved as: {output_filename}")
-                    processed_files_count += 1
-                except PermissionError:
-                    self.log_status(
-                        f"  PERMISSION ERROR saving processed file {output_filename}. Check folder permissions.")
-                except Exception as e_save:
-                    self.log_status(f"  ERROR saving processed file {output_filename}: {e_save}")
-
-
-            except FileNotFoundError:
-                self.log_status(f"ERROR: Source file not found: {source_file_path}")
-            except Exception as e:
-                self.log_status(
-                    f"An unexpected error occurred while processing {os.path.basename(source_file_path)}: {e}")
-
-        self.log_status(f"\n--- Transfer Complete ---")
-        self.log_status(
-            f"Successfully processed {processed_files_count} out of {len(self.source_files)} source file(s).")
-        if processed_files_count > 0:
+        report = finished[1]
+        self.finish_timing_report()
+        processed_files_count = report["processed"]
+        if report["cancelled"]:
+            self.progress_label.config(text=f"Cancelled after {len(report['results'])} / {report['total']} files")
+            messagebox.showinfo("Cancelled",
+                                f"Transfer cancelled. {processed_files_count} file(s) were processed before stopping.")
+        elif processed_files_count > 0:
             messagebox.showinfo("Success",
                                 f"Successfully processed {processed_files_count} file(s). Check the log for details and output locations.")
-        elif self.source_files:  # Only show error if there were files to process
+        else:
             messagebox.showerror("Processing Issue",
                                  "No files were processed successfully, or there were issues saving. Check the log for errors.")
 
+    def finish_timing_report(self):
+        # The engine wrote the report when the batch ended; add the Tk log repaint time and write it again
+        if self.profile is None or self.profile.report_base is None:
+            return
+        seconds, flushes = self.repaint_baseline
+        self.profile.add_stage("log_repaint", self.log_view.flush_seconds - seconds)
+        self.profile.count("log_repaints", self.log_view.flushes - flushes)
+        try:
+            self.profile.write()
+        except OSError as e:
+            self.log_status(f"Could not write the timing report: {e}")
+        self.log_status(f"Status log repaints: {self.log_view.flushes - flushes} taking {self.log_view.flush_seconds - seconds:.2f}s")
+
+    def update_progress(self, done, total):
+        elapsed = time.monotonic() - self.transfer_started
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = (total - done) / rate if rate > 0 else 0.0
+        minutes, seconds = divmod(int(eta), 60)
+        self.progress_bar.config(value=done)
+        self.progress_label.config(text=f"{done} / {total} files  |  {rate:.1f} files/sec  |  ETA {minutes}m {seconds:02d}s")
+
+    def set_running(self, running):
+        # Only one batch at a time; mappings can't change under a running batch
+        state = tk.DISABLED if running else tk.NORMAL
+        self.transfer_button.config(state=state)
+        self.add_row_button.config(state=state)
+        self.delete_rows_button.config(state=state)
+        self.import_button.config(state=state)
+        self.load_profile_button.config(state=state)
+        self.cancel_button.config(state=tk.NORMAL if running else tk.DISABLED)
+
+    def cancel_transfer(self):
+        if self.cancel_event is not None and not self.cancel_event.is_set():
+            self.cancel_event.set()
+            self.cancel_button.config(state=tk.DISABLED)
+            self.log_status("Cancel requested; stopping after the current file...")
 
 if __name__ == '__main__':
-    ''' Create dictionary for column conversion '''
-    letter_convert = {}
-    count = 1
-
-    for i in range(ord('a'), ord('z') + 1):
-        letter_convert[chr(i)] = count
-        count += 1
-
-    for i in range(ord('a'), ord('z') + 1):
-        for j in range(ord('a'), ord('z') + 1):
-            two_letter = chr(i) + chr(j)
-            letter_convert[two_letter] = count
-            count += 1
-
     main_root = tk.Tk()
     app = ExcelProcessorApp(main_root)
     main_root.mainloop()
@@ -0,0 +1,273 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import openpyxl
+from openpyxl.styles import Font, PatternFill, Border, Side
+
+import transfer_engine
+import transfer_profiler
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not reported
+    resource = None
+
+
+''' Benchmark: synthetic workbooks, the transfer pipeline run headless, per-stage timings written to JSON '''
+
+FORMULAS = ["X*2", "(X-32)*5/9", "X/25.4 + 1", "math.sqrt(abs(X))", "math.exp(X/1000)"]
+STAGES = transfer_profiler.FILE_STAGES
+
+
+''' Synthetic workbook generator '''
+def make_source(path, rows, cols, sheets, seed):
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook()
+    for sheet_index in range(sheets):
+        ws = wb.active if sheet_index == 0 else wb.create_sheet(f"Data{sheet_index + 1}")
+        for r in range(1, rows + 1):
+            ws.append([rng.choice((rng.randint(0, 1000), rng.uniform(-500, 500), f"text {r}-{c}"))
+                       if c % 3 else rng.uniform(0, 1000)
+                       for c in range(1, cols + 1)])
+    wb.save(path)
+
+
+def make_base(path, styled_cells, sheets, seed):
+    rng = random.Random(seed)
+    fills = [PatternFill("solid", fgColor=color) for color in ("FFFF00", "C0C0C0", "DDEBF7", "FCE4D6")]
+    fonts = [Font(bold=True), Font(italic=True, size=9), Font(name="Arial", size=11)]
+    border = Border(*(Side(style="thin"),) * 4)
+    wb = openpyxl.Workbook()
+    for sheet_index in range(sheets):
+        ws = wb.active if sheet_index == 0 else wb.create_sheet(f"Sheet{sheet_index + 1}")
+        width = 20
+        for i in range(styled_cells // sheets):
+            cell = ws.cell(row=i // width + 1, column=i % width + 1, value=f"Label {i}" if i % 4 == 0 else None)
+            cell.fill = rng.choice(fills)
+            cell.font = rng.choice(fonts)
+            cell.border = border
+    wb.active = 0
+    wb.save(path)
+
+
+def make_mapping_rows(count, source_rows, source_cols, target_rows, target_cols, formula_mix, seed):
+    # Raw mapping rows as the GUI / mapping CSV would supply them
+    rng = random.Random(seed)
+    mapping_rows = []
+    for _ in range(count):
+        convert = rng.random() < formula_mix
+        mapping_rows.append({
+            "from_row": str(rng.randint(1, source_rows)),
+            "from_col": openpyxl.utils.get_column_letter(rng.randrange(3, source_cols + 1, 3)
+                                                         if convert and source_cols >= 3
+                                                         else rng.randint(1, source_cols)),
+            "to_row": str(rng.randint(1, target_rows)),
+            "to_col": openpyxl.utils.get_column_letter(rng.randint(1, target_cols)),
+            "convert": convert,
+            "formula": rng.choice(FORMULAS) if convert else "",
+        })
+    return mapping_rows
+
+
+def generate(workdir, config):
+    sources = []
+    for i in range(config["source_variants"]):
+        path = os.path.join(workdir, f"source_{i + 1}.xlsx")
+        make_source(path, config["rows"], config["cols"], config["sheets"], config["seed"] + i)
+        sources.append(path)
+    # Many sources are copies of a few generated variants; generating each one would dominate the run
+    sources = [sources[i % len(sources)] for i in range(config["sources"])]
+    copies = []
+    for i, path in enumerate(sources):
+        copy_path = os.path.join(workdir, f"datasheet_{i + 1:05d}.xlsx")
+        shutil.copyfile(path, copy_path)
+        copies.append(copy_path)
+
+    base_path = os.path.join(workdir, "base.xlsx")
+    make_base(base_path, config["styled_cells"], config["sheets"], config["seed"])
+    mapping_rows = make_mapping_rows(config["mappings"], config["rows"], config["cols"],
+                                     max(1, config["styled_cells"] // 20), 20, config["formula_mix"],
+                                     config["seed"])
+    return copies, base_path, mapping_rows
+
+
+''' Pipelines '''
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _pipeline_baseline(source_files, base_file_path, mapping_rows, output_folder_path):
+    # The original ExcelProcessorApp.transfer_values loop, without the GUI: full loads and a per-cell eval
+    mappings = transfer_engine.build_mapping_plan(mapping_rows)
+    timings = dict.fromkeys(STAGES, 0.0)
+    for source_file_path in source_files:
+        start = time.perf_counter()
+        source_sheet = openpyxl.load_workbook(source_file_path, data_only=True).active
+        timings["source_load"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        base_wb_copy = openpyxl.load_workbook(base_file_path)
+        base_sheet_copy = base_wb_copy.active
+        timings["base_load"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        eval_seconds = 0.0
+        for mapping in mappings:
+            value = source_sheet.cell(row=mapping["from_row"], column=mapping["from_col"]).value
+            if mapping["convert"] and mapping["formula"]:
+                eval_start = time.perf_counter()
+                try:
+                    value = eval(mapping["formula"].replace('x', 'X'), {"__builtins__": {}, "math": math}, {"X": value})
+                except Exception:
+                    pass
+                eval_seconds += time.perf_counter() - eval_start
+            base_sheet_copy.cell(row=mapping["to_row"], column=mapping["to_col"]).value = value
+        timings["formula_eval"] += eval_seconds
+        timings["mapping_apply"] += time.perf_counter() - start - eval_seconds
+
+        start = time.perf_counter()
+        base_wb_copy.save(os.path.join(output_folder_path, os.path.basename(source_file_path)))
+        timings["save"] += time.perf_counter() - start
+    return timings
+
+
+def _pipeline_engine(source_files, base_file_path, mapping_rows, output_folder_path, writer):
+    # transfer_engine.transfer_file one file at a time, using the stage timings it reports
+    mappings = transfer_engine.build_mapping_plan(mapping_rows)
+    timings = dict.fromkeys(STAGES, 0.0)
+    for source_file_path in source_files:
+        result = transfer_engine.transfer_file(source_file_path, base_file_path, mappings, output_folder_path,
+                                               writer=writer)
+        for stage, seconds in result["stats"]["stages"].items():
+            timings[stage] = timings.get(stage, 0.0) + seconds
+    transfer_engine.clear_template_cache()
+    return timings
+
+
+def _pipeline_batch(source_files, base_file_path, mapping_rows, output_folder_path, workers):
+    # run_transfer end to end (manifest, workers, logging). With several workers the stages add up
+    # the time spent in every worker, so they can exceed the total.
+    mappings = transfer_engine.build_mapping_plan(mapping_rows)
+    profile = transfer_profiler.TransferProfile()
+    transfer_engine.run_transfer(mappings, source_files, base_file_path, output_folder_path,
+                                 workers=workers, force=True, profile=profile)
+    timings, _ = profile.totals()
+    timings["base_load"] = timings.get("base_load", 0.0) + profile.stages.get("base_preload", 0.0)
+    return timings
+
+
+def _run_scenario(name, source_files, base_file_path, mapping_rows, output_folder_path, workers):
+    # Runs in a fresh process so peak RSS belongs to this scenario alone
+    os.makedirs(output_folder_path, exist_ok=True)
+    start = time.perf_counter()
+    if name == "baseline":
+        timings = _pipeline_baseline(source_files, base_file_path, mapping_rows, output_folder_path)
+    elif name in ("engine-openpyxl", "engine-patch"):
+        timings = _pipeline_engine(source_files, base_file_path, mapping_rows, output_folder_path,
+                                   name.split("-", 1)[1])
+    else:
+        timings = _pipeline_batch(source_files, base_file_path, mapping_rows, output_folder_path, workers)
+    total = time.perf_counter() - start
+    return {
+        "total_seconds": round(total, 4),
+        "files_per_second": round(len(source_files) / total, 2) if total > 0 else None,
+        "stages_seconds": {stage: round(seconds, 4) for stage, seconds in timings.items()},
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+''' Reporting '''
+def print_results(results, previous=None):
+    print(f"{'scenario':<18}{'total s':>10}{'files/s':>10}{'RSS MB':>9}  " + "  ".join(f"{s:>13}" for s in STAGES))
+    for name, result in results.items():
+        stages = "  ".join(f"{result['stages_seconds'].get(s, float('nan')):>13.3f}" for s in STAGES)
+        rss = result["peak_rss_mb"] if result["peak_rss_mb"] is not None else float("nan")
+        line = f"{name:<18}{result['total_seconds']:>10.3f}{result['files_per_second'] or 0:>10.2f}{rss:>9.1f}  {stages}"
+        if previous and name in previous:
+            before = previous[name]["total_seconds"]
+            if before:
+                line += f"   ({(result['total_seconds'] - before) / before:+.1%} vs previous)"
+        print(line)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the datasheet transfer pipeline on synthetic workbooks.")
+    parser.add_argument("--sources", type=int, default=50, help="Number of source files (default 50)")
+    parser.add_argument("--source-variants", type=int, default=5,
+                        help="Distinct generated sources; the rest are copies (default 5)")
+    parser.add_argument("--rows", type=int, default=2000, help="Rows per source sheet (default 2000)")
+    parser.add_argument("--cols", type=int, default=12, help="Columns per source sheet (default 12)")
+    parser.add_argument("--sheets", type=int, default=1, help="Sheets per source and base workbook (default 1)")
+    parser.add_argument("--styled-cells", type=int, default=5000, help="Styled cells in the base workbook (default 5000)")
+    parser.add_argument("--mappings", type=int, default=40, help="Number of cell mappings (default 40)")
+    parser.add_argument("--formula-mix", type=float, default=0.25,
+                        help="Fraction of mappings with a conversion formula (default 0.25)")
+    parser.add_argument("--scenarios", default="baseline,engine-openpyxl,engine-patch,batch",
+                        help="Comma-separated: baseline, engine-openpyxl, engine-patch, batch")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="Workers for the 'batch' scenario (default 1)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", help="Keep generated files here instead of a temporary folder")
+    parser.add_argument("-o", "--output", default="bench_results.json", help="JSON results file")
+    parser.add_argument("--compare", help="Previous JSON results file to compare totals against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = {key: getattr(args, key) for key in
+              ("sources", "source_variants", "rows", "cols", "sheets", "styled_cells", "mappings",
+               "formula_mix", "workers", "seed")}
+    config["source_variants"] = max(1, min(config["source_variants"], config["sources"]))
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="transfer_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        print(f"Generating {config['sources']} source file(s) in {workdir} ...")
+        source_files, base_file_path, mapping_rows = generate(workdir, config)
+
+        results = {}
+        for name in scenarios:
+            print(f"Running {name} ...")
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                results[name] = executor.submit(_run_scenario, name, source_files, base_file_path, mapping_rows,
+                                                os.path.join(workdir, f"out_{name}"), args.workers).result()
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f).get("results")
+    print_results(results, previous)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "openpyxl": openpyxl.__version__,
+        "config": config,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
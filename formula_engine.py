@@ -0,0 +1,229 @@
+import ast
+import math
+
+# NumPy is optional (evaluate_many falls back to a plain loop) and slow to import,
+# so it is only loaded the first time a column is big enough to vectorize
+numpy = None
+_numpy_checked = False
+
+
+def _load_numpy():
+    global numpy, _numpy_checked
+    if not _numpy_checked:
+        _numpy_checked = True
+        try:
+            import numpy
+        except ImportError:
+            pass
+    return numpy
+
+
+''' Conversion formulas: parsed and validated once, then reused for every value in a batch '''
+
+# Plain functions allowed besides math.*
+ALLOWED_FUNCTIONS = {"abs": abs, "min": min, "max": max, "round": round}
+
+_BIN_OPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow)
+_UNARY_OPS = (ast.UAdd, ast.USub)
+_MATH_NAMES = {name for name in dir(math) if not name.startswith("_")}
+
+# math functions whose NumPy twin returns the same float: both are correctly rounded.
+# exp, log, trig, pow and the rest can differ from math.* in the last bit, so they stay on the scalar path.
+_NUMPY_MATH = {"sqrt": "sqrt", "fabs": "fabs"}
+_NUMPY_BIN_OPS = (ast.Add, ast.Sub, ast.Mult, ast.Div)  # Correctly rounded in both; ** // % are not vectorized
+_NUMPY_CONSTANTS = {"pi": math.pi, "e": math.e, "tau": math.tau}
+MAX_POWER_BITS = 100000     # Integer powers larger than this raise OverflowError, as large float powers do
+VECTORIZE_MIN_VALUES = 64   # Below this the plain loop is faster than building arrays
+
+
+class FormulaError(ValueError):
+    ''' Raised when a conversion formula is not a valid arithmetic expression in X '''
+
+
+class _Normalize(ast.NodeTransformer):
+    # 'x' and 'X' are the same variable; only bare names are touched, so math.exp and max survive
+    def visit_Name(self, node):
+        if node.id == "x":
+            return ast.copy_location(ast.Name(id="X", ctx=node.ctx), node)
+        return node
+
+
+def _validate(node):
+    # Walks the expression and rejects anything outside arithmetic, math.* and X
+    if isinstance(node, ast.Expression):
+        return _validate(node.body)
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise FormulaError(f"Only numbers are allowed, not {node.value!r}.")
+        return
+    if isinstance(node, ast.Name):
+        if node.id != "X":
+            raise FormulaError(f"Unknown name '{node.id}'. Use X for the cell value.")
+        return
+    if isinstance(node, ast.BinOp):
+        if not isinstance(node.op, _BIN_OPS):
+            raise FormulaError(f"Operator '{type(node.op).__name__}' is not allowed.")
+        _validate(node.left)
+        _validate(node.right)
+        return
+    if isinstance(node, ast.UnaryOp):
+        if not isinstance(node.op, _UNARY_OPS):
+            raise FormulaError(f"Operator '{type(node.op).__name__}' is not allowed.")
+        _validate(node.operand)
+        return
+    if isinstance(node, ast.Attribute):
+        # Outside a call only the numbers (math.pi, math.inf, ...) are allowed: a function isn't a value
+        if not isinstance(getattr(math, _math_name(node)), float):
+            raise FormulaError(f"math.{node.attr} is a function; call it, e.g. math.{node.attr}(X).")
+        return
+    if isinstance(node, ast.Call):
+        if node.keywords:
+            raise FormulaError("Keyword arguments are not allowed.")
+        func = node.func
+        if isinstance(func, ast.Name):
+            if func.id not in ALLOWED_FUNCTIONS:
+                raise FormulaError(f"Function '{func.id}' is not allowed.")
+        elif not isinstance(func, ast.Attribute):
+            raise FormulaError("Only functions can be called.")
+        elif not callable(getattr(math, _math_name(func))):
+            raise FormulaError(f"math.{func.attr} is a number, not a function.")
+        for arg in node.args:
+            if isinstance(arg, ast.Starred):
+                raise FormulaError("Starred arguments are not allowed.")
+            _validate(arg)
+        return
+    raise FormulaError(f"'{type(node).__name__}' is not allowed in a formula.")
+
+
+def _math_name(node):
+    if not (isinstance(node.value, ast.Name) and node.value.id == "math" and node.attr in _MATH_NAMES):
+        raise FormulaError("Only math.<name> attributes are allowed.")
+    return node.attr
+
+
+def _power(base, exponent):
+    # X ** Y with a size check: integer powers have no upper bound, so a typo such as X**X**X
+    # would otherwise compute for hours and stall the batch
+    if isinstance(base, int) and isinstance(exponent, int) and exponent > 0 and abs(base) > 1 \
+            and exponent * (abs(base).bit_length() - 1) > MAX_POWER_BITS:
+        raise OverflowError("integer power too large")
+    return base ** exponent
+
+
+class _GuardPower(ast.NodeTransformer):
+    # Runs every ** through _power
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Pow):
+            call = ast.Call(func=ast.Name(id="_power", ctx=ast.Load()), args=[node.left, node.right], keywords=[])
+            return ast.copy_location(call, node)
+        return node
+
+
+def _vectorizable(node):
+    # True when NumPy can evaluate the expression over float64 and give the same float as the scalar path
+    if isinstance(node, ast.Expression):
+        return _vectorizable(node.body)
+    if isinstance(node, (ast.Constant, ast.Name)):
+        return True
+    if isinstance(node, ast.BinOp):
+        return isinstance(node.op, _NUMPY_BIN_OPS) and _vectorizable(node.left) and _vectorizable(node.right)
+    if isinstance(node, ast.UnaryOp):
+        return _vectorizable(node.operand)
+    if isinstance(node, ast.Attribute):
+        return node.attr in _NUMPY_CONSTANTS
+    if isinstance(node, ast.Call):
+        if isinstance(node.func, ast.Name):
+            return node.func.id == "abs" and all(_vectorizable(arg) for arg in node.args)
+        return node.func.attr in _NUMPY_MATH and all(_vectorizable(arg) for arg in node.args)
+    return False
+
+
+def _returns_float(node):
+    # True when the expression is a float for any float X (so float64 results keep the scalar type)
+    if isinstance(node, ast.Expression):
+        return _returns_float(node.body)
+    if isinstance(node, ast.Constant):
+        return isinstance(node.value, float)
+    if isinstance(node, ast.Name):
+        return True
+    if isinstance(node, ast.BinOp):
+        return isinstance(node.op, ast.Div) or _returns_float(node.left) or _returns_float(node.right)
+    if isinstance(node, ast.UnaryOp):
+        return _returns_float(node.operand)
+    if isinstance(node, ast.Attribute):
+        return True
+    if isinstance(node, ast.Call):
+        if isinstance(node.func, ast.Name):
+            return node.func.id != "round" and all(_returns_float(arg) for arg in node.args)
+        return True
+    return False
+
+
+class _NumpyMath:
+    # Stands in for the math module when a formula is evaluated over a whole array
+    def __getattr__(self, name):
+        if name in _NUMPY_CONSTANTS:
+            return _NUMPY_CONSTANTS[name]
+        return getattr(numpy, _NUMPY_MATH[name])
+
+
+class CompiledFormula:
+    def __init__(self, text):
+        self.text = text
+        source = text.strip()
+        if not source:
+            raise FormulaError("Formula is empty.")
+        try:
+            tree = ast.parse(source, mode="eval")
+        except SyntaxError as e:
+            raise FormulaError(f"Syntax error: {e.msg}.")
+        tree = ast.fix_missing_locations(_Normalize().visit(tree))
+        _validate(tree)
+
+        self.expression = ast.unparse(tree)  # Normalized text, shown in the log as 'Evaluated'
+        self.uses_x = any(isinstance(node, ast.Name) and node.id == "X" for node in ast.walk(tree))
+        self._vectorizable = _vectorizable(tree) and _returns_float(tree)
+        self._code = compile(ast.fix_missing_locations(_GuardPower().visit(tree)), "<formula>", "eval")
+        self._globals = {"__builtins__": {}, "math": math, "_power": _power, **ALLOWED_FUNCTIONS}
+
+    def __reduce__(self):
+        # Code objects don't pickle; rebuild from the text in worker processes
+        return CompiledFormula, (self.text,)
+
+    def __repr__(self):
+        return f"CompiledFormula({self.text!r})"
+
+    def __call__(self, value):
+        return eval(self._code, self._globals, {"X": value})
+
+    def evaluate_many(self, values):
+        # Evaluate over a column of X values in one call.
+        # Returns (results, errors): results[i] is None where errors[i] holds the exception.
+        values = list(values)
+        results = [None] * len(values)
+        errors = {}
+
+        pending = range(len(values))
+        if self._vectorizable and len(values) >= VECTORIZE_MIN_VALUES and all(
+                type(v) is float and math.isfinite(v) for v in values) and _load_numpy() is not None:
+            with numpy.errstate(all="ignore"):
+                array = eval(self._code, {"__builtins__": {}, "math": _NumpyMath(), "abs": numpy.abs},
+                             {"X": numpy.array(values, dtype=numpy.float64)})
+            array = numpy.broadcast_to(numpy.asarray(array, dtype=numpy.float64), (len(values),))
+            finite = numpy.isfinite(array)
+            results = array.tolist()
+            # Non-finite results are redone one by one so errors (division by zero, math domain) match the scalar path
+            pending = numpy.flatnonzero(~finite).tolist()
+
+        for i in pending:
+            try:
+                results[i] = self(values[i])
+            except Exception as e:
+                results[i] = None
+                errors[i] = e
+        return results, errors
+
+
+def compile_formula(text):
+    return CompiledFormula(text)
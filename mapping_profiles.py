@@ -0,0 +1,134 @@
+import json
+import os
+
+import formula_engine
+import transfer_engine
+
+
+''' Mapping profiles: a mapping plan saved to disk with coordinates resolved and formulas validated '''
+
+PROFILE_VERSION = 1
+PROFILE_EXTENSION = ".json"
+_PLAN_FIELDS = ["from_sheet", "from_row", "from_col", "to_sheet", "to_row", "to_col", "height", "width", "convert",
+                "formula", "lookup_col", "lookup_key"]
+
+
+def save_profile(profile_path, mappings):
+    # mappings: plan from build_mapping_plan. Written to a temporary file first so a failed save keeps the old profile.
+    plan = [{field: mapping[field] for field in _PLAN_FIELDS} for mapping in mappings]
+    temp_path = profile_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": PROFILE_VERSION, "mappings": plan}, f, indent=1)
+    os.replace(temp_path, profile_path)
+
+
+def _position(entry, key, i, optional=False):
+    value = entry.get(key)
+    if value is None and optional:
+        return None
+    limit = transfer_engine.MAX_COL if key.endswith("col") or key == "width" else transfer_engine.MAX_ROW
+    if type(value) is not int or not 0 < value <= limit:
+        raise transfer_engine.MappingError(f"Invalid '{key}' in profile mapping {i + 1}.")
+    return value
+
+
+def _sheet(entry, key, i):
+    value = entry.get(key)
+    try:
+        if value is not None and not isinstance(value, str):
+            raise ValueError
+        return transfer_engine.parse_sheet_name(value)
+    except ValueError:
+        raise transfer_engine.MappingError(f"Invalid '{key}' in profile mapping {i + 1}.")
+
+
+def load_profile(profile_path):
+    # Returns the mapping plan, the same as build_mapping_plan would give for the saved rows.
+    # Coordinates are used as stored; only the distinct formulas are compiled (and so re-validated).
+    try:
+        with open(profile_path, encoding="utf-8") as f:
+            data = json.load(f)
+    except ValueError as e:
+        raise transfer_engine.MappingError(f"Profile '{os.path.basename(profile_path)}' is not valid JSON: {e}")
+    if not isinstance(data, dict) or data.get("version") != PROFILE_VERSION:
+        raise transfer_engine.MappingError(f"Profile '{os.path.basename(profile_path)}' is not a version {PROFILE_VERSION} mapping profile.")
+
+    mappings = []
+    compiled_formulas = {}
+    for i, entry in enumerate(data.get("mappings") or []):
+        if not isinstance(entry, dict):
+            raise transfer_engine.MappingError(f"Invalid profile mapping {i + 1}.")
+        # Missing lookup keys (profiles saved before lookups existed) mean a fixed source cell
+        is_lookup = entry.get("lookup_col") is not None
+        mapping = {key: _position(entry, key, i, optional=key.startswith("to_") or key.startswith("lookup_") or
+                                  (key == "from_row" and is_lookup))
+                   for key in ("from_row", "from_col", "to_row", "to_col", "height", "width", "lookup_col")}
+        if (mapping["to_row"] is None) != (mapping["to_col"] is None):
+            raise transfer_engine.MappingError(f"Invalid target cell in profile mapping {i + 1}.")
+        mapping["lookup_key"] = entry.get("lookup_key")
+        if is_lookup and (mapping["from_row"] is not None or mapping["height"] != 1 or mapping["width"] != 1 or
+                          not isinstance(mapping["lookup_key"], str) or not mapping["lookup_key"].strip()):
+            raise transfer_engine.MappingError(f"Invalid lookup in profile mapping {i + 1}.")
+        if not is_lookup and mapping["lookup_key"] is not None:
+            raise transfer_engine.MappingError(f"Invalid lookup in profile mapping {i + 1}.")
+        for key in ("from_sheet", "to_sheet"):
+            # Missing (profiles saved before sheet names existed) or null: the active sheet
+            mapping[key] = _sheet(entry, key, i)
+        if (mapping["from_row"] or 1) + mapping["height"] - 1 > transfer_engine.MAX_ROW or \
+                mapping["from_col"] + mapping["width"] - 1 > transfer_engine.MAX_COL or \
+                (mapping["to_row"] is not None and (mapping["to_row"] + mapping["height"] - 1 > transfer_engine.MAX_ROW or
+                                                    mapping["to_col"] + mapping["width"] - 1 > transfer_engine.MAX_COL)):
+            raise transfer_engine.MappingError(f"Profile mapping {i + 1} runs past the edge of the sheet.")
+
+        mapping["convert"] = bool(entry.get("convert", False))
+        mapping["formula"] = str(entry.get("formula") or "")
+        mapping["compiled"] = None
+        if mapping["convert"] and mapping["formula"]:
+            compiled = compiled_formulas.get(mapping["formula"])
+            if compiled is None:
+                try:
+                    compiled = compiled_formulas[mapping["formula"]] = formula_engine.compile_formula(mapping["formula"])
+                except formula_engine.FormulaError as e:
+                    raise transfer_engine.MappingError(f"Invalid formula '{mapping['formula']}' in profile mapping {i + 1}: {e}")
+            mapping["compiled"] = compiled
+        mappings.append(mapping)
+
+    if not mappings:
+        raise transfer_engine.MappingError(f"Profile '{os.path.basename(profile_path)}' has no mappings.")
+    return mappings
+
+
+def plan_to_rows(mappings):
+    # Mapping rows (as the GUI / mapping CSV use them) that rebuild the same plan
+    rows = []
+    for mapping in mappings:
+        row = {field: "" for field in transfer_engine.MAPPING_FIELDS}
+        if mapping["lookup_col"] is not None:
+            row["from_col"] = transfer_engine.column_letter(mapping["from_col"])
+            row["lookup_col"] = transfer_engine.column_letter(mapping["lookup_col"])
+            row["lookup_key"] = mapping["lookup_key"]
+        elif mapping["height"] == 1 and mapping["width"] == 1:
+            row["from_row"] = str(mapping["from_row"])
+            row["from_col"] = transfer_engine.column_letter(mapping["from_col"])
+        else:
+            row["from_range"] = transfer_engine.range_text(mapping["from_row"], mapping["from_col"],
+                                                           mapping["height"], mapping["width"])
+        if mapping["to_row"] is not None:
+            row["to_row"] = str(mapping["to_row"])
+            row["to_col"] = transfer_engine.column_letter(mapping["to_col"])
+        row["from_sheet"] = mapping["from_sheet"] or ""
+        row["to_sheet"] = mapping["to_sheet"] or ""
+        row["convert"] = mapping["convert"]
+        row["formula"] = mapping["formula"]
+        rows.append(row)
+    return rows
+
+
+def load_mappings(mapping_file_path, require_target=True):
+    # A saved profile (.json) or a mapping CSV, whichever the file is
+    if mapping_file_path.lower().endswith(PROFILE_EXTENSION):
+        mappings = load_profile(mapping_file_path)
+        if require_target and any(mapping["to_row"] is None for mapping in mappings):
+            raise transfer_engine.MappingError("The profile has mappings without a To cell; it can only be used to consolidate.")
+        return mappings
+    return transfer_engine.build_mapping_plan(transfer_engine.load_mapping_rows(mapping_file_path), require_target)
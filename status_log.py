@@ -0,0 +1,118 @@
+import collections
+import queue
+import threading
+import time
+
+
+''' Status log levels '''
+SUMMARY = 0     # Batch start/end, totals, user actions, files that failed
+FILE = 1        # One or two lines per source file
+CELL = 2        # Every mapping: read, convert, write
+
+LEVEL_NAMES = {"summary": SUMMARY, "file": FILE, "cell": CELL}
+
+
+class _FileSink:
+    # Writes the full trace from a background thread so the caller never waits on disk
+    def __init__(self, path):
+        self._queue = queue.Queue()
+        self._file = open(path, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, name="status-log-file", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            line = self._queue.get()
+            if line is None:
+                break
+            self._file.write(line + "\n")
+        self._file.close()
+
+    def write(self, line):
+        self._queue.put(line)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+class StatusLog:
+    # Callable log sink: status_log(message, level). Lines at or below the verbosity go into a bounded
+    # ring buffer for display; every line goes to the optional log file. Safe to call from any thread.
+    def __init__(self, verbosity=FILE, max_lines=2000, log_file=None, echo=None):
+        self.verbosity = verbosity
+        self.echo = echo                # Optional callable for immediate output (e.g. print in the CLI)
+        self._pending = collections.deque(maxlen=max_lines)
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self._sink = _FileSink(log_file) if log_file else None
+
+    def __call__(self, message, level=FILE):
+        sink = self._sink  # May be closed from another thread
+        if sink is not None:
+            sink.write(message)
+        if level > self.verbosity:
+            return
+        if self.echo is not None:
+            self.echo(message)
+            return
+        with self._lock:
+            if len(self._pending) == self._pending.maxlen:
+                self._dropped += 1
+            self._pending.append(message)
+
+    def wants(self, level):
+        # The log file keeps the full trace, so everything is wanted while it is open
+        return level <= self.verbosity or self._sink is not None
+
+    def drain(self):
+        # Returns the lines waiting for display, with a marker where the ring buffer overflowed
+        with self._lock:
+            lines = list(self._pending)
+            self._pending.clear()
+            dropped, self._dropped = self._dropped, 0
+        if dropped:
+            lines.insert(0, f"... {dropped} earlier line(s) not shown ...")
+        return lines
+
+    def open_file(self, log_file):
+        self.close_file()
+        self._sink = _FileSink(log_file)
+
+    def close_file(self):
+        if self._sink is not None:
+            self._sink.close()
+            self._sink = None
+
+
+class TextLogView:
+    # Moves lines from a StatusLog into a Tk Text widget on a timer, one insert per flush,
+    # keeping at most max_lines in the widget
+    def __init__(self, root, text_widget, status_log, interval_ms=250, max_lines=2000):
+        self.root = root
+        self.text = text_widget
+        self.status_log = status_log
+        self.interval_ms = interval_ms
+        self.max_lines = max_lines
+        self.flush_seconds = 0.0    # Time spent repainting, for the timing report
+        self.flushes = 0
+        self.root.after(self.interval_ms, self._tick)
+
+    def _tick(self):
+        self.flush()
+        self.root.after(self.interval_ms, self._tick)
+
+    def flush(self):
+        lines = self.status_log.drain()
+        if not lines:
+            return
+        start = time.perf_counter()
+        self.text.config(state="normal")
+        self.text.insert("end", "\n".join(lines) + "\n")
+        line_count = int(self.text.index("end-1c").split(".")[0])
+        if line_count > self.max_lines:
+            self.text.delete("1.0", f"{line_count - self.max_lines + 1}.0")
+        self.text.see("end")  # Scroll to the end
+        self.text.config(state="disabled")
+        self.flush_seconds += time.perf_counter() - start
+        self.flushes += 1
@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+import formula_engine
+
+
+''' evaluate_many must give the same floats as calling the formula on each value '''
+
+VECTORIZED = ["X/25.4", "X*25.4 + 3", "-(X - 1.5) / 3", "math.sqrt(abs(X)) * math.pi", "math.fabs(X) / math.e"]
+SCALAR_ONLY = ["math.exp(X / 1e7)", "math.log10(abs(X) + 1)", "math.tan(X)", "abs(X) ** 1.7", "X // 3", "X % 7",
+               "math.pow(abs(X), 1.7)", "math.degrees(X)", "math.hypot(X, 3)"]
+
+
+def random_values(count=5000, seed=1):
+    rng = random.Random(seed)
+    return [rng.uniform(-1e6, 1e6) * rng.choice([1e-9, 1e-3, 1, 1e3]) for _ in range(count)]
+
+
+@pytest.mark.parametrize("text", VECTORIZED + SCALAR_ONLY)
+def test_evaluate_many_matches_scalar(text):
+    formula = formula_engine.compile_formula(text)
+    values = random_values()
+    results, errors = formula.evaluate_many(values)
+    for value, result in zip(values, results):
+        expected = formula(value)
+        assert result == expected and type(result) is type(expected), (text, value)
+    assert not errors
+
+
+@pytest.mark.parametrize("text, vectorized", [(text, True) for text in VECTORIZED] + [(text, False) for text in SCALAR_ONLY])
+def test_only_correctly_rounded_formulas_are_vectorized(text, vectorized):
+    assert formula_engine.compile_formula(text)._vectorizable is vectorized
+
+
+def test_errors_match_scalar():
+    formula = formula_engine.compile_formula("1 / X + math.sqrt(X)")
+    values = [float(i) for i in range(-5, 100)]
+    results, errors = formula.evaluate_many(values)
+    for i, value in enumerate(values):
+        try:
+            expected = formula(value)
+        except Exception as e:
+            assert results[i] is None and type(errors[i]) is type(e)
+        else:
+            assert results[i] == expected and i not in errors
+
+
+''' Validation '''
+
+@pytest.mark.parametrize("text", ["math.sqrt", "X + math.exp", "math.pi(X)", "(X)(2)", "max(X, 1)(2)", "os.sep",
+                                  "math.nope(X)", "__import__('os')", "X if X else 1", "[X]"])
+def test_invalid_formulas_are_rejected(text):
+    with pytest.raises(formula_engine.FormulaError):
+        formula_engine.compile_formula(text)
+
+
+@pytest.mark.parametrize("text, value, expected", [("X * math.pi", 2.0, 2 * 3.141592653589793),
+                                                   ("-math.inf", None, float("-inf")), ("X**2", 3, 9),
+                                                   ("2**X", 10, 1024), ("X**-1", 4, 0.25), ("(-X)**3", 2, -8),
+                                                   ("X**X**X", 2, 16), ("X**0.5", 9.0, 3.0)])
+def test_valid_formulas(text, value, expected):
+    assert formula_engine.compile_formula(text)(value) == expected
+
+
+@pytest.mark.parametrize("text, value", [("X**X**X", 10), ("10**X", 10 ** 9), ("(X**X)**X", 1000)])
+def test_huge_integer_powers_raise_instead_of_hanging(text, value):
+    with pytest.raises(OverflowError):
+        formula_engine.compile_formula(text)(value)
@@ -0,0 +1,140 @@
+import functools
+import os
+import re
+import zipfile
+
+import openpyxl
+import pytest
+
+import transfer_engine
+import transfer_profiler
+
+
+''' Reading sources: fixed blocks, sheets and lookups '''
+
+def make_source(path, rows=50, dimension=None):
+    # Main: A = "key<n>", B = n * 10, D = n; Specs: a 2 x 2 block at B2:C3
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Main"
+    for n in range(1, rows + 1):
+        ws.cell(n, 1, f"key{n}")
+        ws.cell(n, 2, n * 10)
+        ws.cell(n, 4, n)
+    specs = wb.create_sheet("Specs")
+    specs["B2"], specs["C2"], specs["B3"], specs["C3"] = 1.5, "two", None, 4
+    wb.save(path)
+    if dimension is not None:
+        set_declared_dimension(path, "xl/worksheets/sheet1.xml", dimension)
+    return path
+
+
+def set_declared_dimension(path, part, ref):
+    # Rewrite the sheet's <dimension>, as exporters that get it wrong do
+    with zipfile.ZipFile(path) as zin:
+        entries = [(info, zin.read(info.filename)) for info in zin.infolist()]
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zout:
+        for info, data in entries:
+            if info.filename == part:
+                data = re.sub(rb'<dimension ref="[^"]*"', f'<dimension ref="{ref}"'.encode(), data)
+            zout.writestr(info, data)
+
+
+def plan(*rows):
+    return transfer_engine.build_mapping_plan(list(rows))
+
+
+def read(path, mappings):
+    return transfer_engine.read_source_values(path, transfer_engine.source_blocks(mappings),
+                                              transfer_engine.source_lookups(mappings))
+
+
+def test_reads_cells_blocks_and_sheets(tmp_path):
+    path = make_source(str(tmp_path / "source.xlsx"))
+    mappings = plan({"from_row": "30", "from_col": "D", "to_row": "1", "to_col": "A"},
+                    {"from_range": "B2:C3", "from_sheet": "Specs", "to_row": "1", "to_col": "B"},
+                    {"from_range": "A49:B51", "to_row": "5", "to_col": "A"})
+    values = read(path, mappings)
+    assert values[(None, 30, 4, 1, 1)] == [[30]]
+    assert values[("Specs", 2, 2, 2, 2)] == [[1.5, "two"], [None, 4]]
+    assert values[(None, 49, 1, 3, 2)] == [["key49", 490], ["key50", 500], [None, None]]
+
+
+def test_lookups(tmp_path):
+    path = make_source(str(tmp_path / "source.xlsx"))
+    mappings = plan({"lookup_col": "A", "lookup_key": "key40", "from_col": "B", "to_row": "1", "to_col": "A"},
+                    {"lookup_col": "A", "lookup_key": "key3", "from_col": "D", "to_row": "2", "to_col": "A"},
+                    {"lookup_col": "A", "lookup_key": "missing", "from_col": "B", "to_row": "3", "to_col": "A"})
+    values = read(path, mappings)
+    assert values[(None, 1, "key40", 2)] == [[400]]
+    assert values[(None, 1, "key3", 4)] == [[3]]
+    assert (None, 1, "missing", 2) not in values
+
+
+@pytest.mark.parametrize("dimension", ["A1:D1", "A1"])
+def test_stale_dimension(tmp_path, dimension):
+    # A declared <dimension> smaller than the data must not hide rows from lookups or blocks read with them
+    path = make_source(str(tmp_path / "source.xlsx"), dimension=dimension)
+    mappings = plan({"lookup_col": "A", "lookup_key": "key40", "from_col": "B", "to_row": "1", "to_col": "A"},
+                    {"from_row": "30", "from_col": "D", "to_row": "2", "to_col": "A"})
+    values = read(path, mappings)
+    assert values[(None, 1, "key40", 2)] == [[400]]
+    assert values[(None, 30, 4, 1, 1)] == [[30]]
+    assert read(path, mappings[1:]) == {(None, 30, 4, 1, 1): [[30]]}
+
+
+''' Batches: outputs, the manifest and profiles '''
+
+def make_base(path):
+    wb = openpyxl.Workbook()
+    wb.active["A1"] = "Template"
+    wb.save(path)
+    return path
+
+
+def test_manifest_skips_unchanged_sources(tmp_path):
+    base = make_base(str(tmp_path / "base.xlsx"))
+    sources = [make_source(str(tmp_path / f"source{i}.xlsx"), rows=5 + i) for i in range(3)]
+    mappings = plan({"from_row": "5", "from_col": "B", "to_row": "2", "to_col": "B"})
+    output = str(tmp_path / "out")
+
+    first = transfer_engine.run_transfer(mappings, sources, base, output)
+    assert (first["processed"], first["skipped"]) == (3, 0)
+    second = transfer_engine.run_transfer(mappings, sources, base, output)
+    assert (second["processed"], second["skipped"]) == (3, 3)
+
+    make_source(sources[1], rows=9)
+    third = transfer_engine.run_transfer(mappings, sources, base, output)
+    assert (third["processed"], third["skipped"]) == (3, 2)
+    forced = transfer_engine.run_transfer(mappings, sources, base, output, force=True)
+    assert forced["skipped"] == 0
+    assert openpyxl.load_workbook(os.path.join(output, "source1.xlsx")).active["B2"].value == 50
+
+
+def test_profile_is_written(tmp_path):
+    base = make_base(str(tmp_path / "base.xlsx"))
+    sources = [make_source(str(tmp_path / f"source{i}.xlsx")) for i in range(2)]
+    mappings = plan({"lookup_col": "A", "lookup_key": "key7", "from_col": "B", "to_row": "2", "to_col": "B"})
+    profile = transfer_profiler.TransferProfile()
+    transfer_engine.run_transfer(mappings, sources, base, str(tmp_path / "out"), profile=profile)
+    assert len(profile.files) == 2
+    assert os.path.isfile(str(tmp_path / "out_profile.json")) and os.path.isfile(str(tmp_path / "out_profile.csv"))
+
+
+''' Worker processes '''
+
+def exit_on(crashing, source_file_path, log):
+    # A per-file task whose worker process dies on the named files, as it would when out of memory
+    if os.path.basename(source_file_path) in crashing:
+        os._exit(1)
+    return {"source": source_file_path, "output": None, "ok": True, "error": None, "skipped": False}
+
+
+@pytest.mark.parametrize("crashing", [{"f2"}, {"f0"}, {"f7"}, {"f2", "f5"}])
+def test_dead_worker_fails_only_its_own_file(crashing):
+    source_files = [f"f{i}" for i in range(8)]
+    task = functools.partial(exit_on, crashing)
+    results = [result for result, _ in
+               transfer_engine._iter_results_parallel(source_files, task, 2, transfer_engine.SUMMARY, None)]
+    assert [result["source"] for result in results] == source_files
+    assert {result["source"] for result in results if not result["ok"]} == crashing
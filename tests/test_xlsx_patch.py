@@ -0,0 +1,203 @@
+import datetime
+import os
+import zipfile
+from copy import copy
+from decimal import Decimal
+from xml.etree import ElementTree
+
+import openpyxl
+import pytest
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+
+import formula_engine
+import transfer_engine
+import xlsx_patch
+
+
+''' Both writers must produce the same cells: the patch writer is only a faster way to save what openpyxl would '''
+
+VALUES = [
+    0, 7, -3, 12.5, 0.1 + 0.2, 1 / 25.4, 2 / 3, 1e-20, 1.5e300, -0.0, 2 ** 53 + 1, 2 ** 60 + 1, Decimal("1.10"),
+    True, False, None, "", "text", "  ", " pad ", "<&>\"'", "line\nbreak", "µΩ é", "x" * 40000,
+]
+
+
+def make_base(path):
+    # Styled cells, values, gaps (missing rows and cells), a merged range and a second sheet
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Main"
+    ws["A1"] = "Header"
+    ws["A1"].font = Font(bold=True, color="FF0000")
+    ws["B2"] = 1
+    ws["B2"].number_format = "0.00"
+    ws["B2"].fill = PatternFill("solid", fgColor="FFFF00")
+    ws["D2"] = "keep"
+    ws["C4"].border = Border(left=Side(style="thin"))       # Styled but empty
+    ws["E4"] = "=1+1"
+    ws["F8"] = 3.25
+    ws["F8"].alignment = Alignment(horizontal="center")
+    ws.merge_cells("H1:I2")
+    data = wb.create_sheet("Data")
+    data["B3"] = "other"
+    data["B3"].font = Font(italic=True)
+    data["C10"] = 10
+    wb.create_sheet("Untouched")["A1"] = "same"
+    wb.active = 0
+    wb.save(path)
+
+
+# Target cells: styled, in an existing row but missing, in a missing row, before the first cell of a row,
+# past the last row, and on a second sheet
+TARGETS = [(None, 2, 2), (None, 2, 3), (None, 3, 1), (None, 4, 3), (None, 8, 1), (None, 20, 30),
+           ("Data", 3, 2), ("Data", 5, 1), ("Data", 12, 4)]
+
+
+def cell_state(cell):
+    # Style proxies don't compare equal to each other, the styles they wrap do
+    return (cell.value, cell.data_type, cell.number_format, copy(cell.font), copy(cell.fill), copy(cell.border),
+            copy(cell.alignment), copy(cell.protection))
+
+
+def assert_same_cells(patch_path, openpyxl_path):
+    patched = openpyxl.load_workbook(patch_path)
+    expected = openpyxl.load_workbook(openpyxl_path)
+    assert patched.sheetnames == expected.sheetnames
+    for name in expected.sheetnames:
+        ws_patch, ws_expected = patched[name], expected[name]
+        coordinates = set(ws_patch._cells) | set(ws_expected._cells)
+        for row, col in sorted(coordinates):
+            assert cell_state(ws_patch.cell(row, col)) == cell_state(ws_expected.cell(row, col)), (name, row, col)
+        assert ws_patch.merged_cells.ranges == ws_expected.merged_cells.ranges
+
+
+def write_both(tmp_path, base_path, values):
+    # values: {(sheet, row, col): value}; returns the (patch, openpyxl) output paths
+    patch_path = str(tmp_path / "patch.xlsx")
+    patcher = xlsx_patch.SheetPatcher(base_path, values)
+    patcher.save(patch_path, patcher.render(values))
+
+    openpyxl_path = str(tmp_path / "openpyxl.xlsx")
+    wb = openpyxl.load_workbook(base_path)
+    for (sheet, row, col), value in values.items():
+        (wb.active if sheet is None else wb[sheet]).cell(row=row, column=col).value = value
+    wb.save(openpyxl_path)
+    return patch_path, openpyxl_path
+
+
+@pytest.fixture
+def base_path(tmp_path):
+    path = str(tmp_path / "base.xlsx")
+    make_base(path)
+    return path
+
+
+@pytest.mark.parametrize("value", VALUES, ids=lambda value: repr(value)[:30])
+def test_value_matches_openpyxl(tmp_path, base_path, value):
+    values = {target: value for target in TARGETS}
+    assert_same_cells(*write_both(tmp_path, base_path, values))
+
+
+def test_mixed_values_match_openpyxl(tmp_path, base_path):
+    values = {target: VALUES[i % len(VALUES)] for i, target in enumerate(TARGETS)}
+    assert_same_cells(*write_both(tmp_path, base_path, values))
+
+
+def test_converted_floats_match_openpyxl(tmp_path, base_path):
+    # Formula results such as X/25.4 need openpyxl's number formatting to read back the same
+    formula = formula_engine.compile_formula("X/25.4")
+    results = [formula(x + 0.1) for x in range(500)]
+    values = {(None, 30 + i // 20, 1 + i % 20): value for i, value in enumerate(results)}
+    assert_same_cells(*write_both(tmp_path, base_path, values))
+
+
+def test_untouched_sheets_are_copied_as_is(tmp_path, base_path):
+    patch_path = str(tmp_path / "patch.xlsx")
+    patcher = xlsx_patch.SheetPatcher(base_path, [(None, 2, 2)])
+    patcher.save(patch_path, patcher.render({(None, 2, 2): 5}))
+    with zipfile.ZipFile(base_path) as base, zipfile.ZipFile(patch_path) as out:
+        changed = [name for name in base.namelist() if base.read(name) != out.read(name)]
+    assert changed == ["xl/worksheets/sheet1.xml"]
+
+
+def rewrite_part(path, part, old, new):
+    with zipfile.ZipFile(path) as zin:
+        entries = [(info, zin.read(info.filename)) for info in zin.infolist()]
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zout:
+        for info, data in entries:
+            if info.filename == part:
+                assert old in data
+                data = data.replace(old, new)
+            zout.writestr(info, data)
+
+
+@pytest.mark.parametrize("calc_pr", [b'<calcPr calcId="191029"/>', b'<calcPr calcId="191029"></calcPr>', b""])
+def test_dependent_formulas_are_recalculated_on_open(tmp_path, calc_pr):
+    # A template formula that uses a mapped cell keeps its cached result, as Excel saves it; both writers
+    # must make Excel recalculate on open instead of showing that stale result
+    base_path = str(tmp_path / "base.xlsx")
+    wb = openpyxl.Workbook()
+    wb.active["A1"] = 1
+    wb.active["B1"] = "=A1*2"
+    wb.save(base_path)
+    rewrite_part(base_path, "xl/worksheets/sheet1.xml", b"<f>A1*2</f><v />", b"<f>A1*2</f><v>2</v>")
+    rewrite_part(base_path, "xl/workbook.xml", b'<calcPr calcId="124519" fullCalcOnLoad="1" />', calc_pr)
+    assert calc_properties(base_path).get("fullCalcOnLoad") is None
+
+    patch_path, openpyxl_path = write_both(tmp_path, base_path, {(None, 1, 1): 50})
+    assert_same_cells(patch_path, openpyxl_path)
+    for path in (patch_path, openpyxl_path):
+        # Excel recalculates a file on open when it has no calcId, or when fullCalcOnLoad is set
+        properties = calc_properties(path)
+        assert properties.get("fullCalcOnLoad") == "1" or "calcId" not in properties
+    assert calc_properties(patch_path) == calc_properties(openpyxl_path)
+
+
+def calc_properties(path):
+    # calcPr attributes as written (openpyxl reads a missing fullCalcOnLoad as True)
+    with zipfile.ZipFile(path) as archive:
+        workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    calc_pr = workbook.find(f"{{{xlsx_patch.MAIN_NS}}}calcPr")
+    return {} if calc_pr is None else dict(calc_pr.attrib)
+
+
+@pytest.mark.parametrize("value", [float("nan"), float("inf"), 10 ** 400, "=SUM(A1)", "#N/A", "bad\x01",
+                                   datetime.datetime(2024, 5, 1), datetime.date(2024, 5, 1)],
+                         ids=repr)
+def test_values_openpyxl_writes_differently_are_refused(value):
+    with pytest.raises(xlsx_patch.PatchUnsupported):
+        xlsx_patch.render_cell("A1", "", value)
+
+
+@pytest.mark.parametrize("target, reason", [((None, 4, 5), "formula"), ((None, 2, 9), "merged"),
+                                            ("Nope", "not found")])
+def test_unsafe_targets_are_refused(base_path, target, reason):
+    if isinstance(target, str):
+        target = (target, 1, 1)
+    with pytest.raises(xlsx_patch.PatchUnsupported, match=reason):
+        xlsx_patch.SheetPatcher(base_path, [target])
+
+
+def test_transfer_writers_match(tmp_path, base_path):
+    # End to end through the engine, including values the patch writer hands back to openpyxl (dates)
+    sources = []
+    for i, value in enumerate([12.5, datetime.datetime(2024, 5, 1, 10, 30), 1 / 25.4, ""]):
+        source = openpyxl.Workbook()
+        source.active["A1"] = value
+        source.active["A2"] = f"row {i}"
+        source.create_sheet("Specs")["B5"] = i * 1.1
+        path = str(tmp_path / f"source{i}.xlsx")
+        source.save(path)
+        sources.append(path)
+    mappings = transfer_engine.build_mapping_plan([
+        {"from_row": "1", "from_col": "A", "to_row": "2", "to_col": "B"},
+        {"from_row": "2", "from_col": "A", "to_row": "4", "to_col": "C"},
+        {"from_row": "5", "from_col": "B", "from_sheet": "Specs", "to_row": "3", "to_col": "B", "to_sheet": "Data",
+         "convert": True, "formula": "X/25.4"},
+    ])
+    for writer in transfer_engine.WRITERS:
+        report = transfer_engine.run_transfer(mappings, sources, base_path, str(tmp_path / writer), writer=writer)
+        assert report["processed"] == len(sources)
+    for source in sources:
+        name = os.path.basename(source)
+        assert_same_cells(str(tmp_path / "patch" / name), str(tmp_path / "openpyxl" / name))
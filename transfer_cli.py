@@ -0,0 +1,74 @@
+import argparse
+import sys
+
+import mapping_profiles
+import status_log
+import transfer_engine
+import transfer_profiler
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Headless datasheet transfer: copy mapped cells from each source workbook into a copy of the base workbook.")
+    parser.add_argument("sources", nargs="+", help="Source Excel file(s)")
+    parser.add_argument("-b", "--base", help="Base (template) Excel file")
+    parser.add_argument("-m", "--mappings", required=True,
+                        help="Saved mapping profile (.json) or mapping CSV with columns: "
+                             + ",".join(transfer_engine.MAPPING_FIELDS))
+    parser.add_argument("--save-profile", metavar="FILE",
+                        help="Save the checked mappings as a profile (.json) that later runs load without re-parsing")
+    parser.add_argument("-o", "--output", help="Output folder (created if missing)")
+    parser.add_argument("-c", "--consolidate", metavar="FILE",
+                        help="Instead of one output per source, append one row per source to this .csv or .xlsx "
+                             "file (no base file or output folder needed)")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="Worker processes to spread source files across (0 = one per CPU, default 1)")
+    parser.add_argument("--writer", choices=transfer_engine.WRITERS, default="patch",
+                        help="'patch' rewrites only the mapped cells of a copy of the base file (default); "
+                             "'openpyxl' re-serializes the whole workbook")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="Rebuild every output, even ones the output folder's manifest says are up to date")
+    parser.add_argument("-v", "--verbosity", choices=list(status_log.LEVEL_NAMES), default="file",
+                        help="How much to print: 'summary', 'file' (one line per source, default) or 'cell' (every mapping)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Same as --verbosity summary")
+    parser.add_argument("--log-file", help="Also append the full per-cell trace to this file")
+    parser.add_argument("--profile", action="store_true",
+                        help="Time every stage of every file; print the slowest files and write "
+                             "<output>_profile.json/.csv next to the output")
+    parser.add_argument("--cprofile", action="store_true",
+                        help="Like --profile, and also capture the run with cProfile (<output>_profile.prof)")
+    args = parser.parse_args(argv)
+    if not args.consolidate and not (args.base and args.output):
+        parser.error("--base and --output are required unless --consolidate is given")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    verbosity = status_log.SUMMARY if args.quiet else status_log.LEVEL_NAMES[args.verbosity]
+    log = status_log.StatusLog(verbosity, log_file=args.log_file, echo=print)
+
+    profile = transfer_profiler.TransferProfile(cprofile=args.cprofile) if args.profile or args.cprofile else None
+    try:
+        mappings = mapping_profiles.load_mappings(args.mappings, require_target=not args.consolidate)
+        if args.save_profile:
+            mapping_profiles.save_profile(args.save_profile, mappings)
+            log(f"Saved mapping profile: {args.save_profile}", status_log.SUMMARY)
+        if args.consolidate:
+            report = transfer_engine.run_consolidation(mappings, args.sources, args.consolidate, log,
+                                                       workers=args.workers, profile=profile)
+        else:
+            report = transfer_engine.run_transfer(mappings, args.sources, args.base, args.output, log,
+                                                   workers=args.workers, writer=args.writer,
+                                                   force=args.force, profile=profile)
+    except (transfer_engine.MappingError, transfer_engine.TransferError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    finally:
+        log.close_file()
+
+    return 0 if report["processed"] == report["total"] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1156 @@
+import os
+import csv
+import re
+import time
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager, ExitStack
+from copy import copy
+from functools import partial
+
+import formula_engine
+import transfer_manifest
+import transfer_profiler
+from status_log import SUMMARY, FILE, CELL
+
+# openpyxl and xlsx_patch (which needs openpyxl) are imported where they are used:
+# importing openpyxl takes longer than everything else at startup, and nothing needs it until a transfer runs
+
+
+''' Cell references (A1 notation, columns A to XFD) '''
+MAX_ROW = 1048576
+MAX_COL = 16384
+
+_COLUMN_RE = re.compile(r"[A-Za-z]{1,3}")
+_CELL_REF_RE = re.compile(r"\$?([A-Za-z]{1,3})\$?([0-9]+)")
+
+
+def column_index(letters):
+    # "A" -> 1, "ZZ" -> 702, "XFD" -> 16384; None if it isn't a column on a sheet
+    letters = letters.strip()
+    if not _COLUMN_RE.fullmatch(letters):
+        return None
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + ord(letter) - 64
+    return index if index <= MAX_COL else None
+
+
+def column_letter(index):
+    letters = ""
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def parse_cell(ref):
+    # "B10" (or "$B$10") -> (10, 2)
+    match = _CELL_REF_RE.fullmatch(ref.strip())
+    col = column_index(match.group(1)) if match else None
+    row = int(match.group(2)) if match else 0
+    if col is None or not 0 < row <= MAX_ROW:
+        raise ValueError(f"'{ref}' is not a cell like B10.")
+    return row, col
+
+
+def parse_range(range_str):
+    # "B10:AZ210" (or a single cell "B10") -> (row, col, height, width)
+    corners = range_str.split(":")
+    if len(corners) > 2:
+        raise ValueError(f"'{range_str}' is not a cell range like B10:AZ210.")
+    try:
+        (row1, col1), (row2, col2) = parse_cell(corners[0]), parse_cell(corners[-1])
+    except ValueError:
+        raise ValueError(f"'{range_str}' is not a cell range like B10:AZ210.")
+    return min(row1, row2), min(col1, col2), abs(row2 - row1) + 1, abs(col2 - col1) + 1
+
+
+def range_text(row, col, height, width):
+    # (row, col, height, width) -> "B10:AZ210", or "B10" for a single cell
+    ref = f"{column_letter(col)}{row}"
+    if height == 1 and width == 1:
+        return ref
+    return f"{ref}:{column_letter(col + width - 1)}{row + height - 1}"
+
+
+''' Sheet names (None is the active sheet) '''
+_SHEET_NAME_BAD_CHARS = set("[]:*?/\\")
+_PLAIN_SHEET_NAME_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_.]*")
+
+
+def parse_sheet_name(text):
+    # "" -> None (the active sheet); otherwise the name, checked against Excel's rules for sheet names
+    name = str(text or "").strip()
+    if not name:
+        return None
+    if len(name) > 31 or _SHEET_NAME_BAD_CHARS.intersection(name) or name.startswith("'") or name.endswith("'"):
+        raise ValueError(f"'{name}' is not a valid sheet name.")
+    return name
+
+
+def sheet_ref(sheet, ref):
+    # "B10" on the active sheet, "Data!B10" or "'Q1 Data'!B10" on a named one
+    if sheet is None:
+        return ref
+    if _PLAIN_SHEET_NAME_RE.fullmatch(sheet):
+        return f"{sheet}!{ref}"
+    return f"'{sheet}'!{ref}"
+
+
+def _on_sheet(sheet):
+    return "" if sheet is None else f" on sheet '{sheet}'"
+
+
+def lookup_text(value):
+    # Key cells and lookup keys are compared as trimmed, case-insensitive text; 12.0 in a cell matches "12"
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip().casefold() or None
+
+
+class TransferError(Exception):
+    ''' Raised when a batch cannot start (bad paths, unusable output folder) '''
+
+
+class MappingError(ValueError):
+    ''' Raised when the mapping rows cannot be turned into a mapping plan '''
+
+
+def _no_log(message, level=FILE):
+    pass
+
+
+def _wants(log, level):
+    # StatusLog.wants lets the engine skip formatting messages nobody will see
+    wants = getattr(log, "wants", None)
+    return True if wants is None else wants(level)
+
+
+''' Mapping plan '''
+def build_mapping_plan(mapping_rows, require_target=True):
+    # mapping_rows: list of dictionaries of raw strings as typed into the GUI / mapping file
+    #   {"from_row": "3", "from_col": "B", "to_row": "10", "to_col": "C", "convert": bool, "formula": str}
+    # A block mapping gives "from_range" (e.g. "B10:AZ210") instead of from_row/from_col;
+    # to_row/to_col are then the top-left cell of the target block.
+    # Optional "from_sheet"/"to_sheet" name the source and target sheets; empty means the active sheet.
+    # A lookup mapping gives "lookup_col" and "lookup_key" instead of from_row: the value is read from from_col
+    # in the first row whose lookup_col cell equals lookup_key (from_row is then None in the plan).
+    # Each mapping in the plan covers a height x width block; single cells are 1 x 1.
+    # require_target=False (consolidation) allows rows without a To cell; to_row/to_col are then None.
+    mappings = []
+    compiled_formulas = {}  # Mappings that share a formula share one compiled object
+    for i, row_data in enumerate(mapping_rows):
+        mapping = _plan_entry(i, row_data, require_target, compiled_formulas)
+        if mapping is None:
+            if len(mapping_rows) == 1:  # If it's the only row and it's empty
+                raise MappingError("The mapping row is empty. Please fill in the row and column numbers.")
+            continue  # Skip this empty row if there are other rows
+        mappings.append(mapping)
+
+    if not mappings:  # If after validation, no valid mappings were collected
+        raise MappingError("No valid mappings provided. Please fill in at least one mapping row correctly.")
+
+    return mappings
+
+
+def mapping_row_errors(mapping_rows, require_target=True):
+    # Every problem in the rows in one pass, as (row index, message), so an editor can flag all bad rows at once
+    errors = []
+    compiled_formulas = {}
+    for i, row_data in enumerate(mapping_rows):
+        try:
+            _plan_entry(i, row_data, require_target, compiled_formulas)
+        except MappingError as e:
+            errors.append((i, str(e)))
+    return errors
+
+
+def _plan_entry(i, row_data, require_target, compiled_formulas):
+    # One plan entry from one raw mapping row; None if the row is empty
+    from_r_str = str(row_data.get("from_row", "")).strip()
+    from_c_str = str(row_data.get("from_col", "")).strip()
+    from_range_str = str(row_data.get("from_range", "") or "").strip()
+    to_r_str = str(row_data.get("to_row", "")).strip()
+    to_c_str = str(row_data.get("to_col", "")).strip()
+    from_sheet_str = str(row_data.get("from_sheet", "") or "").strip()
+    to_sheet_str = str(row_data.get("to_sheet", "") or "").strip()
+    lookup_c_str = str(row_data.get("lookup_col", "") or "").strip()
+    lookup_key = str(row_data.get("lookup_key", "") or "").strip()
+
+    # Check for From and To
+    if not (from_r_str or from_c_str or from_range_str or to_r_str or to_c_str or from_sheet_str or to_sheet_str
+            or lookup_c_str or lookup_key):
+        return None
+
+    if from_range_str and (from_r_str or from_c_str):
+        raise MappingError(f"Mapping row {i + 1} has both a source range and a From Row/Column. Use one or the other.")
+    is_lookup = bool(lookup_c_str or lookup_key)
+    if is_lookup and (from_r_str or from_range_str):
+        raise MappingError(f"Mapping row {i + 1} is a lookup; leave From Row and Range empty and give the value column as From Col.")
+    if is_lookup and not (lookup_c_str and lookup_key):
+        raise MappingError(f"Lookup in mapping row {i + 1} needs both a key column and a key.")
+    has_target = bool(to_r_str or to_c_str)
+    if not ((from_range_str or (from_r_str and from_c_str) or (is_lookup and from_c_str)) and
+            ((to_r_str and to_c_str) or not (require_target or has_target))):
+        raise MappingError(f"Missing Row/Column in mapping row {i + 1}.")
+
+    try:
+        lookup_c = None
+        if from_range_str:
+            from_r, from_c, height, width = parse_range(from_range_str)
+        elif is_lookup:
+            from_c = column_index(from_c_str)
+            lookup_c = column_index(lookup_c_str)
+            from_r = None
+            height = width = 1
+            if lookup_c is None:
+                raise ValueError("Invalid lookup key column letter specified.")
+        else:
+            from_c = column_index(from_c_str)
+            from_r = int(from_r_str)
+            height = width = 1
+        if has_target:
+            to_c = column_index(to_c_str)
+            to_r = int(to_r_str)
+        else:
+            to_c = to_r = None
+        if from_c is None or (has_target and to_c is None):
+            raise ValueError("Invalid column letter specified.")
+
+        if not ((is_lookup or 0 < from_r <= MAX_ROW) and (not has_target or 0 < to_r <= MAX_ROW)):
+            raise ValueError("Invalid Row/Column specified.")
+        if has_target and (to_r + height - 1 > MAX_ROW or to_c + width - 1 > MAX_COL):
+            raise ValueError("The target block runs past the edge of the sheet.")
+        from_sheet = parse_sheet_name(from_sheet_str)
+        to_sheet = parse_sheet_name(to_sheet_str) if has_target else None
+    except ValueError as e:
+        raise MappingError(f"Invalid input in mapping row {i + 1}: {e}\n"
+                           f"Please enter valid positive integers for rows and column letters for columns.")
+
+    convert = bool(row_data.get("convert", False))
+    formula = str(row_data.get("formula", "") or "").strip()
+    compiled = None
+    if convert and formula:
+        compiled = compiled_formulas.get(formula)
+        if compiled is None:
+            try:
+                compiled = compiled_formulas[formula] = formula_engine.compile_formula(formula)
+            except formula_engine.FormulaError as e:
+                raise MappingError(f"Invalid formula '{formula}' in mapping row {i + 1}: {e}")
+
+    return {
+        "from_sheet": from_sheet, "from_row": from_r, "from_col": from_c,
+        "to_sheet": to_sheet, "to_row": to_r, "to_col": to_c,
+        "height": height, "width": width,
+        "lookup_col": lookup_c, "lookup_key": lookup_key if is_lookup else None,
+        "convert": convert,
+        "formula": formula,
+        "compiled": compiled
+    }
+
+
+''' Mapping file (CSV with a header row) '''
+MAPPING_FIELDS = ["from_row", "from_col", "to_row", "to_col", "convert", "formula", "from_range", "from_sheet", "to_sheet",
+                  "lookup_col", "lookup_key"]
+
+
+def load_mapping_rows(mapping_file_path):
+    mapping_rows = []
+    with open(mapping_file_path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            row = {key.strip().lower(): (value or "").strip() for key, value in row.items() if key}
+            row["convert"] = row.get("convert", "").lower() in ("1", "true", "yes", "y", "x")
+            mapping_rows.append(row)
+    return mapping_rows
+
+
+def save_mapping_rows(mapping_file_path, mapping_rows):
+    # The reverse of load_mapping_rows; convert is written as "yes" or left empty
+    with open(mapping_file_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=MAPPING_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for row in mapping_rows:
+            writer.writerow(dict(row, convert="yes" if row.get("convert") else ""))
+
+
+''' Output folder '''
+def resolve_output_folder(base_file_path, output_folder_name):
+    # Put folder in same folder as Base File
+    output_folder_str = output_folder_name.strip()
+    if not output_folder_str:
+        raise TransferError("Please specify an output folder name.")
+    if not base_file_path or not os.path.isfile(base_file_path):
+        raise TransferError("Base file path is invalid or not selected. Cannot determine output folder location.")
+
+    base_file_dir = os.path.dirname(base_file_path)
+    return os.path.abspath(os.path.join(base_file_dir, output_folder_str))
+
+
+def prepare_output_folder(output_folder_path, log=_no_log):
+    try:
+        if not os.path.exists(output_folder_path):
+            os.makedirs(output_folder_path)
+            log(f"Created output folder: {output_folder_path}", SUMMARY)
+        else:
+            if not os.path.isdir(output_folder_path):
+                raise TransferError(f"Output path '{output_folder_path}' exists but is not a folder.")
+            log(f"Using existing output folder: {output_folder_path}", SUMMARY)
+    except TransferError:
+        raise
+    except Exception as e:
+        raise TransferError(f"Could not create or access output folder '{output_folder_path}': {e}")
+
+
+''' Base template '''
+WRITERS = ("patch", "openpyxl")
+
+
+class BaseTemplate:
+    # The base workbook parsed once and kept as an in-memory master. Each output is either patched
+    # straight into a copy of the base zip (see xlsx_patch) or stamped out by writing the mapped cells
+    # into the openpyxl master, saving it, then putting the touched cells back.
+    def __init__(self, base_file_path):
+        self.path = base_file_path
+        self._workbook = None
+        self.reusable = True
+        self._patchers = {}
+        self.patch_unsupported_reason = None
+
+    @property
+    def workbook(self):
+        if self._workbook is None:
+            import openpyxl
+            self._workbook = openpyxl.load_workbook(self.path)
+            # openpyxl cannot save images, charts or pivot tables from the same loaded workbook twice
+            self.reusable = not self._workbook.chartsheets and not any(
+                ws._images or ws._charts or ws._pivots for ws in self._workbook.worksheets)
+        return self._workbook
+
+    def missing_sheets(self, mappings):
+        # Target sheet names the base file doesn't have; read from workbook.xml without parsing any sheet
+        wanted = {mapping["to_sheet"] for mapping in mappings} - {None}
+        if not wanted:
+            return []
+        import xlsx_patch
+        return sorted(wanted - set(xlsx_patch.read_sheet_names(self.path)))
+
+    def patcher(self, mappings):
+        # Returns a SheetPatcher for these target cells, or None if the base file can't be patched safely
+        import xlsx_patch
+        targets = frozenset(_target_cells(mappings))
+        if targets not in self._patchers:
+            try:
+                self._patchers[targets] = xlsx_patch.SheetPatcher(self.path, targets)
+            except xlsx_patch.PatchUnsupported as e:
+                self._patchers[targets] = None
+                self.patch_unsupported_reason = str(e)
+        return self._patchers[targets]
+
+    @contextmanager
+    def stamp(self, mappings):
+        workbook = self.workbook
+        if not self.reusable:
+            # Load a fresh copy of the base workbook for each source file
+            import openpyxl
+            yield openpyxl.load_workbook(self.path)
+            return
+
+        # Value, type and style are put back: writing a date also changes the cell's number format.
+        # Cells covered by a merged range can't be written, so there is nothing to put back for them.
+        from openpyxl.cell.cell import MergedCell
+        saved_cells = {}
+        for sheet_name, row, col in _target_cells(mappings):
+            sheet = _worksheet(workbook, sheet_name)
+            cell = sheet._cells.get((row, col))
+            if isinstance(cell, MergedCell):
+                continue
+            saved_cells[(sheet, row, col)] = None if cell is None else (cell._value, cell.data_type, copy(cell._style))
+        try:
+            yield workbook
+        finally:
+            for (sheet, row, col), saved in saved_cells.items():
+                try:
+                    if saved is None:
+                        sheet._cells.pop((row, col), None)
+                    else:
+                        cell = sheet._cells[(row, col)]
+                        cell._value, cell.data_type, cell._style = saved
+                except Exception:
+                    # The output is already saved; reparse the master for the next file rather than reuse it dirty
+                    self._workbook = None
+
+
+def _worksheet(workbook, sheet_name):
+    if sheet_name is None:
+        return workbook.active
+    if sheet_name not in workbook.sheetnames:
+        raise ValueError(f"There is no sheet named '{sheet_name}'.")
+    return workbook[sheet_name]
+
+
+def _target_cells(mappings):
+    # (sheet, row, col) of every target cell
+    return [(mapping["to_sheet"], mapping["to_row"] + dr, mapping["to_col"] + dc)
+            for mapping in mappings for dr in range(mapping["height"]) for dc in range(mapping["width"])]
+
+
+_template_cache = {}
+
+
+def get_base_template(base_file_path):
+    # One master per process, reparsed only if the base file changes on disk
+    stat = os.stat(base_file_path)
+    key = (os.path.abspath(base_file_path), stat.st_mtime_ns, stat.st_size)
+    template = _template_cache.get(key)
+    if template is None:
+        _template_cache.clear()
+        template = _template_cache[key] = BaseTemplate(base_file_path)
+    return template
+
+
+def clear_template_cache():
+    _template_cache.clear()
+
+
+''' Source reader '''
+def source_blocks(mappings):
+    # The (sheet, row, col, height, width) source blocks the plan reads at fixed positions
+    return [(mapping["from_sheet"], mapping["from_row"], mapping["from_col"], mapping["height"], mapping["width"])
+            for mapping in mappings if mapping["lookup_col"] is None]
+
+
+def source_lookups(mappings):
+    # The (sheet, key column, key, value column) lookups the plan answers
+    return [(mapping["from_sheet"], mapping["lookup_col"], mapping["lookup_key"], mapping["from_col"])
+            for mapping in mappings if mapping["lookup_col"] is not None]
+
+
+def _source_key(mapping):
+    # The mapping's entry in read_source_values' result
+    if mapping["lookup_col"] is not None:
+        return mapping["from_sheet"], mapping["lookup_col"], mapping["lookup_key"], mapping["from_col"]
+    return mapping["from_sheet"], mapping["from_row"], mapping["from_col"], mapping["height"], mapping["width"]
+
+
+def read_source_values(source_file_path, blocks, lookups=()):
+    # Stream the source in read-only mode and keep only the (sheet, row, col, height, width) blocks the plan needs.
+    # Returns {block: list of rows of values}; a single cell is a 1 x 1 block.
+    # Lookups found in the sheet are added as {lookup: [[value]]}; lookups whose key isn't found are left out.
+    # Only the sheets the blocks name are parsed (read-only workbooks parse a sheet's XML when it is iterated),
+    # and parsing stops once the largest needed row has been passed (and every lookup key found), so large
+    # sheets cost the same as small ones.
+    values = {block: [[None] * block[4] for _ in range(block[3])] for block in blocks}
+    if not values and not lookups:
+        return values
+
+    sheet_reads = {}  # Sheet -> ([blocks], [lookups])
+    for block in values:
+        sheet_reads.setdefault(block[0], ([], []))[0].append(block)
+    for lookup in set(lookups):
+        sheet_reads.setdefault(lookup[0], ([], []))[1].append(lookup)
+
+    import openpyxl
+    source_wb = openpyxl.load_workbook(source_file_path, read_only=True, data_only=True)
+    try:
+        for sheet_name, (blocks, sheet_lookups) in sheet_reads.items():
+            _read_sheet(_worksheet(source_wb, sheet_name), blocks, sheet_lookups, values)
+    finally:
+        source_wb.close()
+    return values
+
+
+def _read_sheet(sheet, blocks, lookups, values):
+    wanted = {}  # Sheet row -> blocks that cover it
+    for block in blocks:
+        _, row, col, height, width = block
+        for r in range(row, row + height):
+            wanted.setdefault(r, []).append(block)
+
+    # One hash index per key column, of the keys the lookups want: each row costs one dictionary probe per
+    # key column however many lookups there are, and the first row with a key answers all lookups for it
+    key_index = {}  # Key column -> {key text: [lookups]}
+    for lookup in lookups:
+        key_index.setdefault(lookup[1], {}).setdefault(lookup_text(lookup[2]), []).append(lookup)
+
+    columns = [block[2] for block in blocks] + [block[2] + block[4] - 1 for block in blocks] + \
+              [col for lookup in lookups for col in (lookup[1], lookup[3])]
+    min_col, max_col = min(columns), max(columns)
+    last_block_row = max(wanted) if wanted else 0
+    # Lookups may match anywhere, so with lookups the sheet is read from the top until every key is found
+    min_row = 1 if key_index else min(wanted)
+    max_row = None if key_index else last_block_row
+    if key_index:
+        # Without a max_row openpyxl stops at the sheet's declared <dimension>, which some exporters get wrong
+        sheet.reset_dimensions()
+
+    rows = sheet.iter_rows(min_row=min_row, max_row=max_row, min_col=min_col, max_col=max_col, values_only=True)
+    for row, row_values in enumerate(rows, min_row):
+        for block in wanted.get(row, ()):
+            start = block[2] - min_col
+            chunk = row_values[start:start + block[4]]
+            values[block][row - block[1]][:len(chunk)] = chunk
+
+        if key_index:
+            for key_col, keys in list(key_index.items()):
+                j = key_col - min_col
+                found = keys.pop(lookup_text(row_values[j]), None) if j < len(row_values) else None
+                for lookup in found or ():
+                    j = lookup[3] - min_col
+                    values[lookup] = [[row_values[j] if j < len(row_values) else None]]
+                if not keys:
+                    del key_index[key_col]
+        if not key_index and row >= last_block_row:
+            break  # Every key found and every block read
+
+
+''' Single source file '''
+def output_path_for(source_file_path, output_folder_path):
+    # Outputs keep the source file's name, inside the output folder
+    return os.path.join(output_folder_path, os.path.basename(source_file_path))
+
+
+def _workbook_writer(workbook):
+    sheets = {}  # Sheet name -> worksheet, looked up once per output
+
+    def write_cell(sheet_name, row, col, value):
+        sheet = sheets.get(sheet_name)
+        if sheet is None:
+            sheet = sheets[sheet_name] = _worksheet(workbook, sheet_name)
+        sheet.cell(row=row, column=col).value = value
+    return write_cell
+
+
+def _flat_values(source_values, mapping):
+    rows = source_values.get(_source_key(mapping)) or [[None]]  # A lookup whose key wasn't found reads as empty
+    return rows[0] if len(rows) == 1 else [value for row in rows for value in row]
+
+
+def _source_text(mapping):
+    # "(3,2)" for a fixed cell, "(column 4 where column 1 = 'Rated Voltage')" for a lookup
+    if mapping["lookup_col"] is None:
+        return f"({mapping['from_row']},{mapping['from_col']})"
+    return f"(column {mapping['from_col']} where column {mapping['lookup_col']} = '{mapping['lookup_key']}')"
+
+
+def _read_source(source_file_path, mappings, log, stats):
+    # Read only the source cells, blocks and lookups the mappings refer to
+    lookups = source_lookups(mappings)
+    with stats.stage("source_load"):
+        source_values = read_source_values(source_file_path, source_blocks(mappings), lookups)
+    stats.count("cells_read", sum(mapping["height"] * mapping["width"] for mapping in mappings))
+    missing = [lookup for lookup in dict.fromkeys(lookups) if lookup not in source_values]
+    if missing:
+        stats.count("lookup_misses", len(missing))
+        for sheet, key_col, key, _ in missing:
+            log(f"  Lookup key '{key}' not found in column {column_letter(key_col)}{_on_sheet(sheet)}; its mappings are left empty.", FILE)
+    return source_values
+
+
+def _convert_values(source_values, mappings, stats):
+    # Each compiled formula is evaluated once over every cell of every mapping that uses it.
+    # Returns {mapping index: (converted values, {position: error})}, positions in row-major block order.
+    with stats.stage("formula_eval"):
+        converted = _evaluate_formulas(source_values, mappings)
+    stats.count("formula_evals", sum(len(results) for results, _ in converted.values()))
+    stats.count("formula_errors", sum(len(errors) for _, errors in converted.values()))
+    return converted
+
+
+def _evaluate_formulas(source_values, mappings):
+    groups = {}
+    for i, mapping in enumerate(mappings):
+        if mapping["compiled"] is not None:
+            groups.setdefault(mapping["compiled"], []).append(i)
+
+    converted = {}
+    for formula, indices in groups.items():
+        values, starts = [], []
+        for i in indices:
+            starts.append(len(values))
+            values.extend(_flat_values(source_values, mappings[i]))
+        results, errors = formula.evaluate_many(values)
+        block_errors = [{} for _ in indices]
+        for j, error in errors.items():
+            k = bisect_right(starts, j) - 1
+            block_errors[k][j - starts[k]] = error
+        for k, i in enumerate(indices):
+            end = starts[k + 1] if k + 1 < len(starts) else len(values)
+            converted[i] = (results[starts[k]:end], block_errors[k])
+    return converted
+
+
+def _block_values(source_values, mapping, converted, log, cell_detail):
+    # The block's values in row-major order, converted where the formula succeeded
+    values = _flat_values(source_values, mapping)
+    if converted is not None:
+        formula = mapping["compiled"]
+        results, errors = converted
+        if errors:
+            values = [values[j] if j in errors else result for j, result in enumerate(results)]
+            if cell_detail:
+                j, error = next(iter(errors.items()))
+                log(f"    ERROR applying formula (User: '{formula.text}', Evaluated: '{formula.expression}') to {len(errors)} of {len(values)} value(s), first '{values[j]}': {error}. Using original values.", CELL)
+        else:
+            values = results
+        if cell_detail:
+            log(f"    Applied formula (User: '{formula.text}', Evaluated: '{formula.expression}') to {len(values) - len(errors)} value(s).", CELL)
+    return values
+
+
+def _apply_block(i, mapping, source_values, converted, write_cell, log, cell_detail):
+    # Block mappings log a few lines per block rather than per cell
+    height, width = mapping["height"], mapping["width"]
+    from_text = sheet_ref(mapping["from_sheet"], range_text(mapping["from_row"], mapping["from_col"], height, width))
+    to_text = sheet_ref(mapping["to_sheet"], range_text(mapping["to_row"], mapping["to_col"], height, width))
+    if cell_detail:
+        log(f"  Applying mapping {i + 1}: From {from_text} To {to_text} ({height * width} cells)", CELL)
+
+    values = _block_values(source_values, mapping, converted, log, cell_detail)
+
+    to_sheet, to_r, to_c = mapping["to_sheet"], mapping["to_row"], mapping["to_col"]
+    failed, first_error = 0, None
+    for j, value in enumerate(values):
+        try:
+            write_cell(to_sheet, to_r + j // width, to_c + j % width, value)
+        except Exception as e:
+            failed += 1
+            first_error = first_error or e
+    if failed:
+        log(f"    ERROR writing {failed} cell(s) of target block {to_text}: {first_error}", CELL)
+    elif cell_detail:
+        log(f"    Wrote {len(values)} value(s) from source block {from_text} to target block {to_text}.", CELL)
+    return len(values) - failed, failed
+
+
+def _apply_mappings(source_values, write_cell, mappings, log, stats):
+    converted = _convert_values(source_values, mappings, stats)
+    with stats.stage("mapping_apply"):
+        written, failed = _write_mappings(source_values, converted, write_cell, mappings, log)
+    stats.count("cells_written", written)
+    stats.count("write_errors", failed)
+
+
+def _write_mappings(source_values, converted, write_cell, mappings, log):
+    # Returns (cells written, cells that could not be written)
+    cell_detail = _wants(log, CELL)  # Per-cell lines are most of the log; don't build them if unused
+    written = failed = 0
+    for i, mapping in enumerate(mappings):
+        if mapping["height"] != 1 or mapping["width"] != 1:
+            block_written, block_failed = _apply_block(i, mapping, source_values, converted.get(i), write_cell, log,
+                                                       cell_detail)
+            written += block_written
+            failed += block_failed
+            continue
+
+        from_on, to_on = _on_sheet(mapping["from_sheet"]), _on_sheet(mapping["to_sheet"])
+        if cell_detail:
+            log(f"  Applying mapping {i + 1}: From {_source_text(mapping)}{from_on} To ({mapping['to_row']},{mapping['to_col']}){to_on}", CELL)
+
+        source_value = _flat_values(source_values, mapping)[0]
+        if cell_detail:
+            log(f"    Read value '{source_value}' from source cell {_source_text(mapping)}{from_on}.", CELL)
+
+        value_to_paste = source_value
+
+        if i in converted:
+            formula = mapping["compiled"]
+            results, errors = converted[i]
+            converted_value, error = results[0], errors.get(0)
+            if error is None:
+                value_to_paste = converted_value
+                if cell_detail:
+                    log(f"    Applied formula (User: '{formula.text}', Evaluated: '{formula.expression}'). Original: {source_value}, Converted: {converted_value}", CELL)
+            elif cell_detail:
+                log(f"    ERROR applying formula (User: '{formula.text}', Evaluated: '{formula.expression}') to value '{source_value}': {error}. Using original value.", CELL)
+
+        try:
+            write_cell(mapping["to_sheet"], mapping["to_row"], mapping["to_col"], value_to_paste)
+            written += 1
+            if cell_detail:
+                log(f"    Wrote value '{value_to_paste}' to target cell ({mapping['to_row']},{mapping['to_col']}){to_on}.", CELL)
+        except Exception as e:
+            failed += 1
+            log(f"    ERROR writing to target cell ({mapping['to_row']},{mapping['to_col']}){to_on}: {e}", CELL)
+    return written, failed
+
+
+def _save_output(save, output_filename, result, log):
+    try:
+        save(output_filename)
+        log(f"  Successfully processed. Output saved as: {output_filename}", FILE)
+        result["output"] = output_filename
+        result["ok"] = True
+    except PermissionError:
+        result["error"] = f"PERMISSION ERROR saving processed file {output_filename}. Check folder permissions."
+        log(f"  {result['error']}", SUMMARY)
+    except Exception as e_save:
+        result["error"] = f"ERROR saving processed file {output_filename}: {e_save}"
+        log(f"  {result['error']}", SUMMARY)
+
+
+def _transfer_patched(patcher, template, source_values, mappings, output_filename, result, log, stats):
+    # Collect the target values, then patch them into a byte copy of the base file.
+    # Values the patcher can't write exactly like openpyxl are replayed into the openpyxl master instead.
+    import xlsx_patch
+    target_values = {}
+    _apply_mappings(source_values, lambda sheet, row, col, value: target_values.__setitem__((sheet, row, col), value),
+                    mappings, log, stats)
+    try:
+        with stats.stage("save"):
+            sheet_bytes = patcher.render(target_values)
+    except xlsx_patch.PatchUnsupported:
+        with ExitStack() as stack:
+            with stats.stage("base_load"):
+                base_wb_copy = stack.enter_context(template.stamp(mappings))
+            with stats.stage("mapping_apply"):
+                write_cell = _workbook_writer(base_wb_copy)
+                for (sheet, row, col), value in target_values.items():
+                    try:
+                        write_cell(sheet, row, col, value)
+                    except Exception as e:
+                        stats.count("write_errors")
+                        log(f"    ERROR writing to target cell ({row},{col}){_on_sheet(sheet)}: {e}", CELL)
+            with stats.stage("save"):
+                _save_output(base_wb_copy.save, output_filename, result, log)
+        return
+    with stats.stage("save"):
+        _save_output(lambda path: patcher.save(path, sheet_bytes), output_filename, result, log)
+
+
+def transfer_file(source_file_path, base_file_path, mappings, output_folder_path, log=_no_log, writer="patch"):
+    # Returns a result dictionary; never raises for per-file problems.
+    # result["stats"] holds the per-stage timings and counters, result["seconds"] the time for the whole file.
+    result = {"source": source_file_path, "output": None, "ok": False, "error": None, "skipped": False}
+    stats = transfer_profiler.FileStats()
+    start = time.perf_counter()
+    try:
+        log(f"\nProcessing source file: {os.path.basename(source_file_path)}", FILE)
+
+        source_values = _read_source(source_file_path, mappings, log, stats)
+
+        output_filename = output_path_for(source_file_path, output_folder_path)
+
+        with stats.stage("base_load"):
+            template = get_base_template(base_file_path)
+            patcher = template.patcher(mappings) if writer == "patch" else None
+        if patcher is not None:
+            _transfer_patched(patcher, template, source_values, mappings, output_filename, result, log, stats)
+        else:
+            # Stamp out a copy of the base workbook from the preparsed master
+            with ExitStack() as stack:
+                with stats.stage("base_load"):
+                    base_wb_copy = stack.enter_context(template.stamp(mappings))
+                _apply_mappings(source_values, _workbook_writer(base_wb_copy), mappings, log, stats)
+                with stats.stage("save"):
+                    _save_output(base_wb_copy.save, output_filename, result, log)
+
+    except FileNotFoundError:
+        result["error"] = f"ERROR: Source file not found: {source_file_path}"
+        log(result["error"], SUMMARY)
+    except Exception as e:
+        result["error"] = f"An unexpected error occurred while processing {os.path.basename(source_file_path)}: {e}"
+        log(result["error"], SUMMARY)
+
+    result["seconds"] = time.perf_counter() - start
+    result["stats"] = stats.as_dict()
+    return result
+
+
+''' Parallel workers '''
+class _BufferedLog:
+    # Collects (message, level) pairs in a worker process, keeping only levels the parent will show
+    def __init__(self, max_level):
+        self.max_level = max_level
+        self.lines = []
+
+    def __call__(self, message, level=FILE):
+        if level <= self.max_level:
+            self.lines.append((message, level))
+
+    def wants(self, level):
+        return level <= self.max_level
+
+
+def _run_buffered(task, source_file_path, max_level):
+    # Runs in a worker process; log lines are collected and replayed by the parent in source order
+    log = _BufferedLog(max_level)
+    result = task(source_file_path, log=log)
+    return result, log.lines
+
+
+def _cancelled(cancel):
+    return cancel is not None and cancel.is_set()
+
+
+# task: a per-file function called as task(source_file_path, log=log) that returns a result dictionary,
+# e.g. functools.partial(transfer_file, base_file_path=..., ...)
+def _iter_results_sequential(source_files, task, log, cancel):
+    for source_file_path in source_files:
+        if _cancelled(cancel):
+            return
+        yield task(source_file_path, log=log), ()
+
+
+def _iter_results_parallel(source_files, task, workers, max_level, cancel):
+    # A worker that dies (e.g. out of memory) breaks the whole pool and every file still in it fails with it.
+    # Those files are run again in a new pool, the first of them on its own: a file is only reported as failed
+    # when it breaks a pool by itself.
+    finished = {}  # Index -> (result, log lines) of files that finished before their pool broke
+    start, alone = 0, False
+    while start < len(source_files):
+        if start and _cancelled(cancel):
+            return
+        batch = source_files[start:start + 1] if alone else source_files[start:]
+        broken_at = None
+        with ProcessPoolExecutor(max_workers=1 if alone else workers) as executor:
+            futures = {i: executor.submit(_run_buffered, task, source_file_path, max_level)
+                       for i, source_file_path in enumerate(batch, start) if i not in finished}
+            try:
+                for i, source_file_path in enumerate(batch, start):
+                    if i in finished:
+                        yield finished.pop(i)
+                        continue
+                    future = futures[i]
+                    if _cancelled(cancel):
+                        # Drop files not started yet; files already in a worker still finish and are reported
+                        for pending in futures.values():
+                            pending.cancel()
+                    if future.cancelled():
+                        return  # Files start in order, so everything after this was cancelled too
+                    try:
+                        yield future.result()
+                    except BrokenProcessPool as e:
+                        if not alone:
+                            finished.update((j, f.result()) for j, f in futures.items()
+                                            if j > i and f.done() and not f.cancelled() and f.exception() is None)
+                            broken_at = i
+                            break
+                        yield _worker_failure(source_file_path, e)
+                    except Exception as e:
+                        yield _worker_failure(source_file_path, e)
+            finally:
+                # Stopped early (cancel, broken pool or error in the caller): don't start the rest on the way out
+                for pending in futures.values():
+                    pending.cancel()
+        if broken_at is None:
+            start, alone = start + len(batch), False
+        else:
+            start, alone = broken_at, True
+
+
+def _worker_failure(source_file_path, e):
+    error = f"An unexpected error occurred while processing {os.path.basename(source_file_path)}: {e}"
+    return {"source": source_file_path, "output": None, "ok": False, "error": error, "skipped": False}, \
+        [(error, SUMMARY)]
+
+
+def resolve_workers(workers):
+    # 0 or None means one worker per CPU
+    if not workers:
+        return os.cpu_count() or 1
+    return max(1, int(workers))
+
+
+def _iter_results(source_files, task, log, workers, cancel):
+    if workers > 1:
+        log(f"Using {workers} worker processes.", SUMMARY)
+        max_level = next(level for level in (CELL, FILE, SUMMARY) if level == SUMMARY or _wants(log, level))
+        return _iter_results_parallel(source_files, task, workers, max_level, cancel)
+    return _iter_results_sequential(source_files, task, log, cancel)
+
+
+''' Whole batch '''
+def _finish_profile(profile, output_path, log):
+    # Logs the timing summary and writes the report next to the output
+    for line in profile.summary_lines():
+        log(line, SUMMARY)
+    profile.report_base = transfer_profiler.report_base_for(output_path)
+    try:
+        paths = profile.write()
+        log(f"Timing report written: {paths[0]}", SUMMARY)
+    except OSError as e:
+        log(f"Could not write the timing report: {e}", SUMMARY)
+
+
+def run_transfer(mappings, source_files, base_file_path, output_folder_path, log=_no_log, workers=1,
+                 writer="patch", progress=None, cancel=None, force=False, profile=None):
+    # mappings: plan from build_mapping_plan; returns a report dictionary
+    # workers: number of processes to spread source files across (1 = run in this process)
+    # writer: "patch" copies the base file and rewrites only the mapped cells, falling back to
+    #         openpyxl where that isn't safe; "openpyxl" always re-serializes the whole workbook
+    # progress: optional progress(done, total, result) called after each source file
+    # cancel: optional threading.Event; once set, the batch stops after the file(s) in progress
+    # force: rebuild every output even if the manifest says it is up to date
+    # profile: optional transfer_profiler.TransferProfile; filled in, summarized in the log and
+    #          written as <output folder>_profile.json/.csv
+    if writer not in WRITERS:
+        raise TransferError(f"Unknown output writer '{writer}'.")
+    if not source_files:
+        raise TransferError("Please select at least one source Excel file.")
+    if not base_file_path or not os.path.isfile(base_file_path):
+        raise TransferError(f"Base file not found: {base_file_path}")
+    if not mappings:
+        raise TransferError("No valid mappings provided.")
+
+    prepare_output_folder(output_folder_path, log)
+
+    log("Starting value transfer process...", SUMMARY)
+    log(f"Collected {len(mappings)} mapping configurations.", SUMMARY)
+
+    report_profile = profile is not None
+    profile = profile or transfer_profiler.TransferProfile()
+    profile.start()
+
+    # Skip sources whose output was built from the same source, base and mapping plan
+    with profile.stage("manifest_check"):
+        try:
+            manifest = transfer_manifest.TransferManifest(output_folder_path, base_file_path, mappings)
+        except OSError as e:
+            profile.stop()
+            raise TransferError(f"Could not read base file '{base_file_path}': {e}")
+        unchanged = set()
+        if not force:
+            unchanged = {i for i, source_file_path in enumerate(source_files)
+                         if manifest.is_current(source_file_path, output_path_for(source_file_path, output_folder_path))}
+    if unchanged:
+        log(f"{len(unchanged)} source file(s) unchanged since the last run will be skipped.", SUMMARY)
+    pending_files = [f for i, f in enumerate(source_files) if i not in unchanged]
+
+    workers = min(resolve_workers(workers), max(1, len(pending_files)))
+    if pending_files:
+        # Parse the base template up front so a broken template fails the batch once, not per file
+        try:
+            with profile.stage("base_preload"):
+                template = get_base_template(base_file_path)
+                missing = template.missing_sheets(mappings)
+                if missing:
+                    raise ValueError("it has no sheet named " + ", ".join(f"'{name}'" for name in missing))
+                if writer == "patch" and template.patcher(mappings) is None:
+                    log(f"Fast output writer not available for this base file ({template.patch_unsupported_reason}); using openpyxl.", SUMMARY)
+                    writer = "openpyxl"
+                if writer == "openpyxl":
+                    template.workbook
+        except Exception as e:
+            profile.stop()
+            raise TransferError(f"Could not open base file '{base_file_path}': {e}")
+
+    task = partial(transfer_file, base_file_path=base_file_path, mappings=mappings,
+                   output_folder_path=output_folder_path, writer=writer)
+    result_iter = _iter_results(pending_files, task, log, workers, cancel)
+
+    results = []
+    try:
+        for i, source_file_path in enumerate(source_files):
+            output_filename = output_path_for(source_file_path, output_folder_path)
+            if i in unchanged:
+                if _cancelled(cancel):
+                    break
+                log(f"Unchanged, skipped: {os.path.basename(source_file_path)}", FILE)
+                result = {"source": source_file_path, "output": output_filename, "ok": True, "error": None,
+                          "skipped": True}
+            else:
+                result, log_lines = next(result_iter, (None, ()))
+                if result is None:  # Cancelled
+                    break
+                for message, level in log_lines:
+                    log(message, level)
+                if result["ok"]:
+                    manifest.record(source_file_path, output_filename)
+                else:
+                    manifest.forget(output_filename)
+            results.append(result)
+            profile.add_file(result)
+            if progress is not None:
+                progress(len(results), len(source_files), result)
+    finally:
+        result_iter.close()
+        clear_template_cache()
+        try:
+            manifest.save()
+        except OSError as e:
+            log(f"Could not save the run manifest: {e}", SUMMARY)
+        profile.stop()
+
+    cancelled = len(results) < len(source_files)
+    processed_files_count = sum(1 for r in results if r["ok"])
+    skipped_files_count = sum(1 for r in results if r["skipped"])
+    if cancelled:
+        log(f"\n--- Transfer Cancelled ---", SUMMARY)
+        log(f"Stopped after {len(results)} of {len(source_files)} source file(s).", SUMMARY)
+    else:
+        log(f"\n--- Transfer Complete ---", SUMMARY)
+    log(f"Successfully processed {processed_files_count} out of {len(source_files)} source file(s)"
+        + (f" ({skipped_files_count} unchanged and skipped)." if skipped_files_count else "."), SUMMARY)
+    if report_profile:
+        _finish_profile(profile, output_folder_path, log)
+
+    return {
+        "processed": processed_files_count,
+        "skipped": skipped_files_count,
+        "total": len(source_files),
+        "cancelled": cancelled,
+        "output_folder": output_folder_path,
+        "results": results
+    }
+
+
+''' Consolidation: one row per source file in a single output '''
+def consolidation_header(mappings):
+    # "Source File", then the source cell reference of every mapped value ("Data!B10" on a named sheet,
+    # "D where A = 'Rated Voltage'" for a lookup)
+    header = ["Source File"]
+    for mapping in mappings:
+        if mapping["lookup_col"] is not None:
+            header.append(sheet_ref(mapping["from_sheet"], f"{column_letter(mapping['from_col'])} where "
+                                                           f"{column_letter(mapping['lookup_col'])} = '{mapping['lookup_key']}'"))
+            continue
+        for dr in range(mapping["height"]):
+            for dc in range(mapping["width"]):
+                header.append(sheet_ref(mapping["from_sheet"],
+                                        f"{column_letter(mapping['from_col'] + dc)}{mapping['from_row'] + dr}"))
+    return header
+
+
+def consolidate_file(source_file_path, mappings, log=_no_log):
+    # Reads and converts one source file's mapped values; result["row"] is the row to append
+    result = {"source": source_file_path, "output": None, "ok": False, "error": None, "skipped": False, "row": None}
+    stats = transfer_profiler.FileStats()
+    start = time.perf_counter()
+    try:
+        log(f"\nProcessing source file: {os.path.basename(source_file_path)}", FILE)
+        source_values = _read_source(source_file_path, mappings, log, stats)
+        converted = _convert_values(source_values, mappings, stats)
+        with stats.stage("mapping_apply"):
+            cell_detail = _wants(log, CELL)
+            row = [os.path.basename(source_file_path)]
+            for i, mapping in enumerate(mappings):
+                row.extend(_block_values(source_values, mapping, converted.get(i), log, cell_detail))
+        result["row"] = row
+    except FileNotFoundError:
+        result["error"] = f"ERROR: Source file not found: {source_file_path}"
+        log(result["error"], SUMMARY)
+    except Exception as e:
+        result["error"] = f"An unexpected error occurred while processing {os.path.basename(source_file_path)}: {e}"
+        log(result["error"], SUMMARY)
+    result["seconds"] = time.perf_counter() - start
+    result["stats"] = stats.as_dict()
+    return result
+
+
+class ConsolidatedWriter:
+    # Streams rows to a .csv file or an openpyxl write-only workbook, so memory stays flat
+    # however many source files are appended
+    def __init__(self, output_file_path, header):
+        self.path = output_file_path
+        extension = os.path.splitext(output_file_path)[1].lower()
+        if extension not in (".csv", ".xlsx"):
+            raise TransferError(f"Consolidated output must be a .csv or .xlsx file, not '{output_file_path}'.")
+        self._file = self._csv = self._workbook = self._sheet = None
+        if extension == ".csv":
+            self._file = open(output_file_path, "w", newline="", encoding="utf-8-sig")
+            self._csv = csv.writer(self._file)
+        else:
+            import openpyxl
+            self._workbook = openpyxl.Workbook(write_only=True)
+            self._sheet = self._workbook.create_sheet("Consolidated")
+        self.append(header)
+
+    def append(self, row):
+        if self._csv is not None:
+            self._csv.writerow(row)
+        else:
+            self._sheet.append(row)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        else:
+            self._workbook.save(self.path)
+
+
+def run_consolidation(mappings, source_files, output_file_path, log=_no_log, workers=1, progress=None, cancel=None,
+                      profile=None):
+    # Appends one row per source file (file name, then every mapped value) to a single .csv or .xlsx output.
+    # No base file is used; mappings may omit the To cell. Returns a report like run_transfer's.
+    # profile: as for run_transfer; the report is written as <output file name>_profile.json/.csv
+    if not source_files:
+        raise TransferError("Please select at least one source Excel file.")
+    if not mappings:
+        raise TransferError("No valid mappings provided.")
+
+    output_folder_path = os.path.dirname(os.path.abspath(output_file_path))
+    prepare_output_folder(output_folder_path, log)
+
+    log("Starting consolidation...", SUMMARY)
+    log(f"Collected {len(mappings)} mapping configurations.", SUMMARY)
+    try:
+        writer = ConsolidatedWriter(output_file_path, consolidation_header(mappings))
+    except OSError as e:
+        raise TransferError(f"Could not create consolidated output '{output_file_path}': {e}")
+
+    report_profile = profile is not None
+    profile = profile or transfer_profiler.TransferProfile()
+    profile.start()
+
+    workers = min(resolve_workers(workers), len(source_files))
+    task = partial(consolidate_file, mappings=mappings)
+    result_iter = _iter_results(source_files, task, log, workers, cancel)
+
+    results = []
+    rows_written = 1  # Header
+    try:
+        for result, log_lines in result_iter:
+            for message, level in log_lines:
+                log(message, level)
+            row = result.pop("row", None)
+            if row is not None:
+                start = time.perf_counter()
+                try:
+                    writer.append(row)
+                    rows_written += 1
+                    result["output"] = output_file_path
+                    result["ok"] = True
+                    log(f"  Added row {rows_written} to {os.path.basename(output_file_path)}.", FILE)
+                except Exception as e:
+                    result["error"] = f"ERROR writing row for {os.path.basename(result['source'])}: {e}"
+                    log(f"  {result['error']}", SUMMARY)
+                result["stats"]["stages"]["save"] = time.perf_counter() - start
+                result["seconds"] += result["stats"]["stages"]["save"]
+            results.append(result)
+            profile.add_file(result)
+            if progress is not None:
+                progress(len(results), len(source_files), result)
+    finally:
+        result_iter.close()
+        try:
+            with profile.stage("output_save"):
+                writer.close()
+        except Exception as e:
+            raise TransferError(f"Could not save consolidated output '{output_file_path}': {e}")
+        finally:
+            profile.stop()
+
+    cancelled = len(results) < len(source_files)
+    processed_files_count = sum(1 for r in results if r["ok"])
+    if cancelled:
+        log(f"\n--- Consolidation Cancelled ---", SUMMARY)
+        log(f"Stopped after {len(results)} of {len(source_files)} source file(s).", SUMMARY)
+    else:
+        log(f"\n--- Consolidation Complete ---", SUMMARY)
+    log(f"Consolidated {processed_files_count} out of {len(source_files)} source file(s) into {output_file_path}.", SUMMARY)
+    if report_profile:
+        _finish_profile(profile, output_file_path, log)
+
+    return {
+        "processed": processed_files_count,
+        "skipped": 0,
+        "total": len(source_files),
+        "cancelled": cancelled,
+        "output_folder": output_folder_path,
+        "output": output_file_path,
+        "results": results
+    }
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+
+
+''' Incremental runs: a manifest in the output folder remembers what each output was built from '''
+
+MANIFEST_NAME = ".transfer_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+_OPTIONAL_KEYS = ("from_sheet", "to_sheet", "lookup_col", "lookup_key")
+
+
+def plan_hash(mappings):
+    # Hash of the normalized mapping plan: positions, convert flag and the normalized formula.
+    # Formulas that only differ in spacing or x/X case hash the same. Optional keys that are not in use
+    # (active sheet, no lookup) are left out, so plans from before they existed keep their hash.
+    normalized = []
+    for mapping in mappings:
+        entry = {key: value for key, value in mapping.items() if key not in ("compiled", "formula")
+                 and not (key in _OPTIONAL_KEYS and value is None)}
+        compiled = mapping.get("compiled")
+        entry["formula"] = compiled.expression if compiled is not None else ""
+        normalized.append(entry)
+    text = json.dumps(normalized, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _stat_key(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class TransferManifest:
+    def __init__(self, output_folder_path, base_file_path, mappings):
+        self.path = os.path.join(output_folder_path, MANIFEST_NAME)
+        self.base_hash = file_hash(base_file_path)
+        self.plan_hash = plan_hash(mappings)
+        self.entries = {}
+        self._hashes = {}   # Source hashes computed during this run
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.entries = data.get("outputs", {})
+        except (OSError, ValueError, AttributeError):
+            pass  # Missing or unreadable manifest: everything is rebuilt
+
+    def source_hash(self, source_file_path, output_filename):
+        # Reuse the stored hash when the source's size and modification time haven't changed
+        source = os.path.abspath(source_file_path)
+        size, mtime_ns = _stat_key(source_file_path)
+        if (source, size, mtime_ns) in self._hashes:
+            return self._hashes[(source, size, mtime_ns)]
+        entry = self.entries.get(os.path.basename(output_filename))
+        if entry and entry.get("source") == source and \
+                entry.get("source_size") == size and entry.get("source_mtime_ns") == mtime_ns:
+            source_hash = entry["source_hash"]
+        else:
+            source_hash = file_hash(source_file_path)
+        self._hashes[(source, size, mtime_ns)] = source_hash
+        return source_hash
+
+    def is_current(self, source_file_path, output_filename):
+        entry = self.entries.get(os.path.basename(output_filename))
+        if not entry or entry.get("base_hash") != self.base_hash or entry.get("plan_hash") != self.plan_hash:
+            return False
+        try:
+            if [entry.get("output_size"), entry.get("output_mtime_ns")] != list(_stat_key(output_filename)):
+                return False  # Output deleted or edited since it was written
+            return entry.get("source_hash") == self.source_hash(source_file_path, output_filename)
+        except OSError:
+            return False
+
+    def record(self, source_file_path, output_filename):
+        size, mtime_ns = _stat_key(source_file_path)
+        output_size, output_mtime_ns = _stat_key(output_filename)
+        self.entries[os.path.basename(output_filename)] = {
+            "source": os.path.abspath(source_file_path),
+            "source_size": size,
+            "source_mtime_ns": mtime_ns,
+            "source_hash": self.source_hash(source_file_path, output_filename),
+            "base_hash": self.base_hash,
+            "plan_hash": self.plan_hash,
+            "output_size": output_size,
+            "output_mtime_ns": output_mtime_ns,
+        }
+
+    def forget(self, output_filename):
+        self.entries.pop(os.path.basename(output_filename), None)
+
+    def save(self):
+        # Write to a temporary file first so an interrupted save never leaves a half-written manifest
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "outputs": self.entries}, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
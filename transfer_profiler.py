@@ -0,0 +1,160 @@
+import csv
+import json
+import os
+import time
+from contextlib import contextmanager
+
+
+''' Instrumentation: per-stage timers and counters for each source file, and a report for the whole run '''
+
+FILE_STAGES = ["source_load", "base_load", "formula_eval", "mapping_apply", "save"]
+COUNTERS = ["cells_read", "cells_written", "formula_evals", "formula_errors", "write_errors", "lookup_misses"]
+
+
+class FileStats:
+    # Cheap enough to keep on for every file: a few perf_counter calls per stage, not per cell
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def as_dict(self):
+        # Plain data, so it can travel back from worker processes inside the result dictionary
+        return {"stages": dict(self.stages), "counters": dict(self.counters)}
+
+
+class TransferProfile(FileStats):
+    # Batch-level stages (manifest check, template preload, ...) plus the stats of every file.
+    # With cprofile=True the run is also captured with cProfile (this process only, not worker processes).
+    def __init__(self, cprofile=False):
+        super().__init__()
+        self.files = []
+        self.seconds = 0.0
+        self.report_base = None     # Report path without extension; set by the run
+        self._start = None
+        self._profiler = None
+        if cprofile:
+            import cProfile
+            self._profiler = cProfile.Profile()
+
+    def start(self):
+        self._start = time.perf_counter()
+        if self._profiler is not None:
+            self._profiler.enable()
+
+    def stop(self):
+        if self._profiler is not None:
+            self._profiler.disable()
+        if self._start is not None:
+            self.seconds += time.perf_counter() - self._start
+            self._start = None
+
+    def add_file(self, result):
+        stats = result.get("stats") or {}
+        self.files.append({
+            "source": result["source"],
+            "ok": result["ok"],
+            "skipped": result["skipped"],
+            "seconds": result.get("seconds", 0.0),
+            "stages": stats.get("stages", {}),
+            "counters": stats.get("counters", {}),
+        })
+
+    def totals(self):
+        stages, counters = {}, {}
+        for entry in self.files:
+            for name, seconds in entry["stages"].items():
+                stages[name] = stages.get(name, 0.0) + seconds
+            for name, amount in entry["counters"].items():
+                counters[name] = counters.get(name, 0) + amount
+        return stages, counters
+
+    def slowest(self, count=5):
+        return sorted((entry for entry in self.files if not entry["skipped"]),
+                      key=lambda entry: entry["seconds"], reverse=True)[:count]
+
+    def summary_lines(self, count=5):
+        stages, counters = self.totals()
+        processed = sum(1 for entry in self.files if not entry["skipped"])
+        rate = processed / self.seconds if self.seconds > 0 else 0.0
+        lines = [f"Timing: {self.seconds:.2f}s for {processed} file(s) ({rate:.1f} files/sec)"]
+        if stages:
+            lines.append("  Stages: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in _ordered(stages, FILE_STAGES)))
+        if counters:
+            lines.append("  Counts: " + ", ".join(f"{name} {amount}" for name, amount in _ordered(counters, COUNTERS)))
+        slowest = self.slowest(count)
+        if slowest:
+            lines.append("  Slowest files:")
+            for entry in slowest:
+                top = sorted(entry["stages"].items(), key=lambda item: item[1], reverse=True)[:2]
+                detail = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in top)
+                lines.append(f"    {entry['seconds']:.2f}s  {os.path.basename(entry['source'])}" + (f"  ({detail})" if detail else ""))
+        return lines
+
+    def write(self, report_base=None):
+        # Writes <base>.json (everything), <base>.csv (one row per file) and, with cProfile, <base>.prof
+        # and <base>_cprofile.txt. Returns the paths written.
+        report_base = report_base or self.report_base
+        stages, counters = self.totals()
+        processed = sum(1 for entry in self.files if not entry["skipped"])
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "seconds": round(self.seconds, 4),
+            "files": len(self.files),
+            "processed": processed,
+            "files_per_second": round(processed / self.seconds, 2) if self.seconds > 0 else None,
+            "batch_stages": {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            "file_stages": {name: round(seconds, 4) for name, seconds in _ordered(stages, FILE_STAGES)},
+            "counters": dict(_ordered(counters, COUNTERS)),
+            "slowest": [entry["source"] for entry in self.slowest()],
+            "per_file": self.files,
+        }
+        paths = [report_base + ".json", report_base + ".csv"]
+        with open(paths[0], "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+
+        stage_names = [name for name, _ in _ordered(stages, FILE_STAGES)]
+        counter_names = [name for name, _ in _ordered(counters, COUNTERS)]
+        with open(paths[1], "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["source", "ok", "skipped", "seconds"] + stage_names + counter_names)
+            for entry in self.files:
+                writer.writerow([entry["source"], entry["ok"], entry["skipped"], round(entry["seconds"], 4)]
+                                + [round(entry["stages"].get(name, 0.0), 4) for name in stage_names]
+                                + [entry["counters"].get(name, 0) for name in counter_names])
+
+        if self._profiler is not None:
+            import pstats
+            paths.append(report_base + ".prof")
+            self._profiler.dump_stats(paths[-1])
+            paths.append(report_base + "_cprofile.txt")
+            with open(paths[-1], "w", encoding="utf-8") as f:
+                pstats.Stats(self._profiler, stream=f).sort_stats("cumulative").print_stats(40)
+        return paths
+
+
+def _ordered(values, known):
+    # Known names first in their usual order, then anything else
+    return [(name, values[name]) for name in known if name in values] + \
+           [(name, value) for name, value in values.items() if name not in known]
+
+
+def report_base_for(output_path):
+    # The report sits next to the output: "<output folder>_profile.*" or "<consolidated file stem>_profile.*"
+    output_path = os.path.normpath(os.path.abspath(output_path))
+    if os.path.splitext(output_path)[1].lower() in (".csv", ".xlsx"):
+        output_path = os.path.splitext(output_path)[0]
+    return output_path + "_profile"
@@ -0,0 +1,331 @@
+import numbers
+import posixpath
+import re
+import zipfile
+from decimal import Decimal
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from openpyxl.cell.cell import ERROR_CODES, ILLEGAL_CHARACTERS_RE
+from openpyxl.compat import safe_string
+from openpyxl.utils import get_column_letter, range_boundaries
+
+
+''' Fast output writer: copy the base .xlsx entries and rewrite only the mapped cells of the target sheets '''
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+DOC_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+_SHEET_DATA_RE = re.compile(r'<sheetData\s*/>|<sheetData\b[^>]*>(.*?)</sheetData>', re.S)
+_ROW_RE = re.compile(r'<row\b([^>]*?)(/>|>(.*?)</row>)', re.S)
+_CELL_RE = re.compile(r'<c\b([^>]*?)(/>|>(.*?)</c>)', re.S)
+_ATTR_RE = re.compile(r'([\w:]+)\s*=\s*("[^"]*"|\'[^\']*\')')
+_DIMENSION_RE = re.compile(r'(<dimension\b[^>]*\bref=")([^"]*)(")')
+_MERGE_RE = re.compile(r'<mergeCell\b[^>]*\bref="([^"]*)"')
+_FORMULA_RE = re.compile(r'<f[\s/>]')
+_CALC_PR_RE = re.compile(r'<calcPr\b([^>]*?)/?>(?:\s*</calcPr>)?')
+
+
+class PatchUnsupported(Exception):
+    ''' Raised when the base file or a value cannot be patched safely; callers fall back to openpyxl '''
+
+
+def _attributes(attr_text):
+    return {name: value[1:-1] for name, value in _ATTR_RE.findall(attr_text)}
+
+
+def _attr_text(attributes):
+    return "".join(f' {name}="{value}"' for name, value in attributes.items())
+
+
+def _resolve_target(base_dir, target):
+    if target.startswith("/"):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(base_dir, target))
+
+
+def _read_rels(entries, part_path):
+    rels_path = posixpath.join(posixpath.dirname(part_path), "_rels", posixpath.basename(part_path) + ".rels")
+    if rels_path not in entries:
+        raise PatchUnsupported(f"missing relationships part {rels_path}")
+    tree = ElementTree.fromstring(entries[rels_path])
+    return {rel.get("Id"): rel for rel in tree.iter(f"{{{REL_NS}}}Relationship")}
+
+
+MAX_STRING_LENGTH = 32767  # openpyxl truncates longer strings
+
+
+def render_cell(ref, style, value):
+    # Mirrors what openpyxl writes for the same value; anything else is left to openpyxl
+    if value is None:
+        return f'<c r="{ref}"{style}/>'
+    if isinstance(value, str) and not value:
+        return f'<c r="{ref}"{style} t="inlineStr"/>'  # openpyxl writes an empty string as an empty cell element
+    if isinstance(value, bool):
+        return f'<c r="{ref}"{style} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (numbers.Integral, float, Decimal)):
+        # safe_string is openpyxl's own number format ("%.16g"), so both writers round the same way
+        try:
+            text = safe_string(value)
+        except OverflowError:
+            raise PatchUnsupported("number too large for a float")
+        if not text:
+            raise PatchUnsupported(f"non-finite number {value}")
+        return f'<c r="{ref}"{style} t="n"><v>{text}</v></c>'
+    if isinstance(value, str):
+        value = value[:MAX_STRING_LENGTH]
+        if (value.startswith("=") and len(value) > 1) or value in ERROR_CODES or ILLEGAL_CHARACTERS_RE.search(value):
+            raise PatchUnsupported("formula, error code or illegal characters in string value")
+        space = ' xml:space="preserve"' if value != value.strip() else ""
+        return f'<c r="{ref}"{style} t="inlineStr"><is><t{space}>{escape(value)}</t></is></c>'
+    raise PatchUnsupported(f"unsupported value type {type(value).__name__}")
+
+
+def _workbook_path(entries):
+    root_rels = _read_rels(entries, "")
+    workbook_path = None
+    for rel in root_rels.values():
+        if rel.get("Type", "").endswith("/officeDocument"):
+            workbook_path = _resolve_target("", rel.get("Target"))
+    if workbook_path is None or workbook_path not in entries:
+        raise PatchUnsupported("workbook part not found")
+    return workbook_path
+
+
+def _workbook_sheets(entries):
+    # Returns ([(sheet name, sheet part path or None if not a worksheet)], active sheet index) from workbook.xml
+    workbook_path = _workbook_path(entries)
+    workbook = ElementTree.fromstring(entries[workbook_path])
+    view = workbook.find(f"{{{MAIN_NS}}}bookViews/{{{MAIN_NS}}}workbookView")
+    active_index = int(view.get("activeTab", 0)) if view is not None else 0
+
+    workbook_rels = _read_rels(entries, workbook_path)
+    sheets = []
+    for sheet in workbook.findall(f"{{{MAIN_NS}}}sheets/{{{MAIN_NS}}}sheet"):
+        rel = workbook_rels.get(sheet.get(f"{{{DOC_REL_NS}}}id"))
+        path = None
+        if rel is not None and rel.get("Type", "").endswith("/worksheet"):
+            path = _resolve_target(posixpath.dirname(workbook_path), rel.get("Target"))
+        sheets.append((sheet.get("name"), path))
+    return sheets, active_index
+
+
+def _full_calc_on_load(workbook_xml):
+    # Excel keeps the cached results of formulas when the file's calcId matches its own, so formulas that
+    # depend on a patched cell would show the template's numbers. openpyxl sets fullCalcOnLoad; so do we.
+    # Without a calcPr there is no calcId and Excel recalculates anyway.
+    if f'xmlns="{MAIN_NS}"' not in workbook_xml:
+        raise PatchUnsupported("workbook XML does not use the default spreadsheet namespace")
+    match = _CALC_PR_RE.search(workbook_xml)
+    if match is None:
+        return workbook_xml
+    attributes = _attributes(match.group(1))
+    if attributes.get("fullCalcOnLoad") in ("1", "true"):
+        return workbook_xml
+    attributes["fullCalcOnLoad"] = "1"
+    return workbook_xml[:match.start()] + f"<calcPr{_attr_text(attributes)}/>" + workbook_xml[match.end():]
+
+
+def read_sheet_names(file_path):
+    # Sheet names of an .xlsx file from workbook.xml alone, without parsing any sheet
+    with zipfile.ZipFile(file_path) as archive:
+        names = set(archive.namelist())
+        entries = {name: archive.read(name) for name in names
+                   if name.endswith(".rels") or name.endswith("workbook.xml")}
+    return [name for name, _ in _workbook_sheets(entries)[0]]
+
+
+class SheetPatcher:
+    # Built once per base file and set of target cells. Each target sheet's XML is split into static
+    # text and one slot per target cell, so each output only renders the slots and joins the parts.
+    # Sheets without target cells are copied as bytes and never parsed.
+    def __init__(self, base_file_path, targets):
+        # targets: (sheet name, or None for the active sheet, row, col)
+        targets = set(targets)
+        if not targets:
+            raise PatchUnsupported("no target cells")
+
+        with zipfile.ZipFile(base_file_path) as archive:
+            self.infos = archive.infolist()
+            entries = {info.filename: archive.read(info) for info in self.infos}
+        self.entries = entries
+
+        sheets, active_index = _workbook_sheets(entries)
+        workbook_path = _workbook_path(entries)
+        try:
+            workbook_xml = entries[workbook_path].decode("utf-8")
+        except UnicodeDecodeError:
+            raise PatchUnsupported("workbook XML is not UTF-8")
+        entries[workbook_path] = _full_calc_on_load(workbook_xml).encode("utf-8")
+        sheet_targets = {}  # Sheet part path -> {(row, col): target key}
+        for key in targets:
+            sheet_path = self._find_sheet(entries, sheets, active_index, key[0])
+            cells = sheet_targets.setdefault(sheet_path, {})
+            if (key[1], key[2]) in cells:
+                raise PatchUnsupported(f"cell ({key[1]},{key[2]}) is targeted through two sheet names")
+            cells[(key[1], key[2])] = key
+
+        self.sheet_parts = {}
+        for sheet_path, cells in sheet_targets.items():
+            try:
+                sheet_xml = entries[sheet_path].decode("utf-8")
+            except UnicodeDecodeError:
+                raise PatchUnsupported("sheet XML is not UTF-8")
+            if f'xmlns="{MAIN_NS}"' not in sheet_xml:
+                raise PatchUnsupported("sheet XML does not use the default spreadsheet namespace")
+            self._check_merged_cells(sheet_xml, cells)
+            self.sheet_parts[sheet_path] = self._split_sheet(sheet_xml, cells)
+
+    ''' Locating the target sheets '''
+    def _find_sheet(self, entries, sheets, active_index, sheet_name):
+        if sheet_name is None:
+            if not 0 <= active_index < len(sheets):
+                raise PatchUnsupported("active sheet index out of range")
+            sheet_name, sheet_path = sheets[active_index]
+        else:
+            sheet_path = dict(sheets).get(sheet_name, False)
+            if sheet_path is False:
+                raise PatchUnsupported(f"sheet '{sheet_name}' not found")
+        if sheet_path is None:
+            raise PatchUnsupported(f"sheet '{sheet_name}' is not a worksheet")
+        if sheet_path not in entries:
+            raise PatchUnsupported(f"sheet part {sheet_path} not found")
+        return sheet_path
+
+    def _check_merged_cells(self, sheet_xml, cells):
+        # openpyxl refuses writes into the covered cells of a merged range; keep that behaviour
+        for ref in _MERGE_RE.findall(sheet_xml):
+            min_col, min_row, max_col, max_row = range_boundaries(ref)
+            for row, col in cells:
+                if min_row <= row <= max_row and min_col <= col <= max_col and (row, col) != (min_row, min_col):
+                    raise PatchUnsupported(f"target cell inside merged range {ref}")
+
+    ''' Splitting a sheet into static text and cell slots '''
+    def _split_sheet(self, sheet_xml, cells):
+        match = _SHEET_DATA_RE.search(sheet_xml)
+        if match is None:
+            raise PatchUnsupported("sheetData not found")
+        inner = match.group(1) or ""
+
+        self._cells = cells  # Used by _slot while this sheet is split
+        target_rows = {}
+        for row, col in cells:
+            target_rows.setdefault(row, []).append(col)
+
+        parts = [self._expand_dimension(sheet_xml[:match.start()], cells), "<sheetData>"]
+        pending_rows = sorted(target_rows)
+        position = 0
+        for row_match in _ROW_RE.finditer(inner):
+            attributes = _attributes(row_match.group(1))
+            if "r" not in attributes:
+                raise PatchUnsupported("row without a row number")
+            row_number = int(attributes["r"])
+
+            while pending_rows and pending_rows[0] < row_number:
+                parts.append(inner[position:row_match.start()])
+                position = row_match.start()
+                new_row = pending_rows.pop(0)
+                self._append_row(parts, new_row, {"r": str(new_row)}, "", target_rows[new_row])
+
+            if pending_rows and pending_rows[0] == row_number:
+                pending_rows.pop(0)
+                parts.append(inner[position:row_match.start()])
+                position = row_match.end()
+                attributes.pop("spans", None)  # Optional hint; may no longer cover the row
+                self._append_row(parts, row_number, attributes, row_match.group(3) or "", target_rows[row_number])
+
+        parts.append(inner[position:])
+        for new_row in pending_rows:
+            self._append_row(parts, new_row, {"r": str(new_row)}, "", target_rows[new_row])
+        parts.append("</sheetData>")
+        parts.append(sheet_xml[match.end():])
+
+        # Merge neighbouring static text so saving only joins what it has to
+        merged = []
+        for part in parts:
+            if isinstance(part, str) and merged and isinstance(merged[-1], str):
+                merged[-1] += part
+            elif part != "":
+                merged.append(part)
+        return merged
+
+    def _append_row(self, parts, row_number, attributes, content, target_cols):
+        parts.append(f"<row{_attr_text(attributes)}>")
+        pending_cols = sorted(target_cols)
+        position = 0
+        for cell_match in _CELL_RE.finditer(content):
+            cell_attributes = _attributes(cell_match.group(1))
+            if "r" not in cell_attributes:
+                raise PatchUnsupported(f"cell without a reference in row {row_number}")
+            min_col, _, _, _ = range_boundaries(cell_attributes["r"])
+
+            while pending_cols and pending_cols[0] < min_col:
+                parts.append(content[position:cell_match.start()])
+                position = cell_match.start()
+                parts.append(self._slot(row_number, pending_cols.pop(0), {}))
+
+            if pending_cols and pending_cols[0] == min_col:
+                if _FORMULA_RE.search(cell_match.group(3) or ""):
+                    raise PatchUnsupported(f"target cell {cell_attributes['r']} holds a formula")
+                pending_cols.pop(0)
+                parts.append(content[position:cell_match.start()])
+                position = cell_match.end()
+                parts.append(self._slot(row_number, min_col, cell_attributes))
+
+        # Remaining target cells go after the last cell but before any row extension list
+        tail = content[position:]
+        ext_start = tail.find("<extLst")
+        if ext_start < 0:
+            ext_start = len(tail)
+        parts.append(tail[:ext_start])
+        for col in pending_cols:
+            parts.append(self._slot(row_number, col, {}))
+        parts.append(tail[ext_start:])
+        parts.append("</row>")
+
+    def _slot(self, row, col, cell_attributes):
+        style = f' s="{cell_attributes["s"]}"' if "s" in cell_attributes else ""
+        return (self._cells[(row, col)], f"{get_column_letter(col)}{row}", style)
+
+    def _expand_dimension(self, head, cells):
+        match = _DIMENSION_RE.search(head)
+        if match is None:
+            return head
+        try:
+            min_col, min_row, max_col, max_row = range_boundaries(match.group(2))
+        except ValueError:
+            return head
+        if min_col is None or min_row is None:
+            return head
+        max_col = max_col or min_col
+        max_row = max_row or min_row
+        for row, col in cells:
+            min_row, max_row = min(min_row, row), max(max_row, row)
+            min_col, max_col = min(min_col, col), max(max_col, col)
+        ref = f"{get_column_letter(min_col)}{min_row}:{get_column_letter(max_col)}{max_row}"
+        return head[:match.start(2)] + ref + head[match.end(2):]
+
+    ''' Writing outputs '''
+    def render(self, values):
+        # values: {(sheet, row, col): value}; returns {sheet part path: XML bytes}.
+        # Raises PatchUnsupported if any value can't be written like openpyxl would.
+        rendered = {}
+        for sheet_path, parts in self.sheet_parts.items():
+            pieces = []
+            for part in parts:
+                if isinstance(part, str):
+                    pieces.append(part)
+                else:
+                    key, ref, style = part
+                    pieces.append(render_cell(ref, style, values.get(key)))
+            rendered[sheet_path] = "".join(pieces).encode("utf-8")
+        return rendered
+
+    def save(self, output_filename, rendered):
+        with zipfile.ZipFile(output_filename, "w") as out:
+            for info in self.infos:
+                copy_info = zipfile.ZipInfo(info.filename, info.date_time)
+                copy_info.compress_type = info.compress_type
+                copy_info.external_attr = info.external_attr
+                out.writestr(copy_info, rendered.get(info.filename, self.entries[info.filename]))